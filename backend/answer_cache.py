@@ -0,0 +1,151 @@
+"""
+Answer Cache for MINI-RAG Backend
+
+Semantic cache of generated answers, so a question that is a near-duplicate of one
+asked recently ("what is photosynthesis" / "explain photosynthesis") is answered
+with a single vector lookup instead of a retrieval plus a Gemini generation.
+Entries live in the Supabase ``answer_cache`` table, are matched by cosine
+similarity of the query embedding through the ``match_answer_cache`` function,
+expire after ANSWER_CACHE_TTL_SECONDS and are dropped when a cited PDF is
+re-indexed or deleted. A small per-process LRU keyed by the normalized query
+text sits in front, so a repeated question is answered without even embedding it.
+
+Exports:
+- get_recent: Return the answer and results for a question asked recently in this process.
+- lookup: Return the cached answer and results for a query embedding, if any.
+- store: Save a generated answer with the results it was built from.
+- invalidate: Drop cached answers that cite a given PDF.
+"""
+from collections import OrderedDict
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+
+import orjson
+
+ANSWER_CACHE_TABLE = "answer_cache"
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.92"))
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+ANSWER_CACHE_L1_SIZE = int(os.getenv("ANSWER_CACHE_L1_SIZE", "512"))
+ANSWER_CACHE_L1_TTL_SECONDS = 300   # short, since other processes cannot invalidate it
+TABLE_RETRY_SECONDS = 300      # back off from the table after a failed request
+
+logger = logging.getLogger(__name__)
+
+_NON_WORD_RE = re.compile(r"[\W_]+")
+
+_l1 = OrderedDict()            # normalized query -> (expires_at, answer, results)
+_l1_lock = threading.Lock()
+_table_disabled_until = 0.0
+
+
+def _query_key(query: str) -> str:
+    return " ".join(_NON_WORD_RE.sub(" ", unicodedata.normalize("NFKC", query).lower()).split())
+
+
+def _remember(query: str, answer: str, results: list):
+    key = _query_key(query)
+    with _l1_lock:
+        _l1[key] = (time.monotonic() + ANSWER_CACHE_L1_TTL_SECONDS, answer, results)
+        _l1.move_to_end(key)
+        while len(_l1) > ANSWER_CACHE_L1_SIZE:
+            _l1.popitem(last=False)
+
+
+def get_recent(query: str):
+    """
+    Return (answer, results) if the same question, ignoring case, punctuation and
+    spacing, was answered in this process within ANSWER_CACHE_L1_TTL_SECONDS.
+    """
+    if not ANSWER_CACHE_ENABLED:
+        return None
+    key = _query_key(query)
+    with _l1_lock:
+        entry = _l1.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del _l1[key]
+            return None
+        _l1.move_to_end(key)
+        return entry[1], entry[2]
+
+
+def _table_available() -> bool:
+    return ANSWER_CACHE_ENABLED and time.monotonic() >= _table_disabled_until
+
+
+def _disable_table(exc: Exception):
+    global _table_disabled_until
+    _table_disabled_until = time.monotonic() + TABLE_RETRY_SECONDS
+    logger.warning("Answer cache unavailable, retrying in %ds: %s", TABLE_RETRY_SECONDS, exc)
+
+
+def lookup(sb, query: str, query_embedding: list):
+    """
+    Find a fresh cached answer whose query is within ANSWER_CACHE_THRESHOLD cosine
+    similarity of `query_embedding` (a JSON-serializable list); a hit is also kept
+    in the per-process cache under `query`.
+    Returns (answer, results) or None on a miss.
+    """
+    if sb is None or not _table_available():
+        return None
+    try:
+        rows = sb.rpc("match_answer_cache", {
+            "query_embedding": query_embedding,
+            "similarity_threshold": ANSWER_CACHE_THRESHOLD,
+            "max_age_seconds": ANSWER_CACHE_TTL_SECONDS,
+        }).execute().data or []
+    except Exception as exc:
+        _disable_table(exc)
+        return None
+    if not rows:
+        return None
+    answer, results = rows[0]["answer"], orjson.loads(rows[0]["results_json"])
+    _remember(query, answer, results)
+    return answer, results
+
+
+def store(sb, query: str, query_embedding: list, answer: str, results: list):
+    """
+    Cache a generated answer together with the search results it was built from.
+    """
+    if not ANSWER_CACHE_ENABLED or not results:
+        return
+    _remember(query, answer, results)
+    if sb is None or not _table_available():
+        return
+    try:
+        sb.table(ANSWER_CACHE_TABLE).insert({
+            "embedding": query_embedding,
+            "answer": answer,
+            "results_json": orjson.dumps(results).decode(),
+            "sources": sorted({r["source"] for r in results}),
+        }, returning="minimal").execute()
+    except Exception as exc:
+        _disable_table(exc)
+
+
+def invalidate(sb, source_file: str):
+    """
+    Drop cached answers that cite `source_file`, e.g. after it is re-indexed or deleted.
+    """
+    with _l1_lock:
+        for key in [k for k, (_, _, results) in _l1.items()
+                    if any(r["source"] == source_file for r in results)]:
+            del _l1[key]
+    if sb is None or not ANSWER_CACHE_ENABLED:
+        return
+    try:
+        (
+            sb.table(ANSWER_CACHE_TABLE)
+            .delete(returning="minimal")
+            .contains("sources", [source_file])
+            .execute()
+        )
+    except Exception as exc:
+        _disable_table(exc)
@@ -3,13 +3,16 @@
 Database Configuration for MINI-RAG Backend
 
 This module manages all database connections and configuration for the backend.
-All tables (users, feedback, search_history, analytics, pdfs, pdf_chunks, rag_embeddings)
+All tables (users, feedback, search_history, analytics, pdfs, pdf_chunks, rag_embeddings,
+embedding_cache, answer_cache)
 are stored in Supabase PostgreSQL. No local SQLite is used.
 
 Exports:
 - init_supabase: Initializes Supabase clients (anon and service-role).
 - supabase: Anon client for restricted access.
 - supabase_admin: Service-role client for full access (bypasses RLS).
+- verify_connection: Round-trips a trivial query to check Supabase is reachable.
+- close_supabase: Closes the pooled HTTP connections used by the clients.
 """
 import os
 from dotenv import load_dotenv
@@ -60,6 +63,29 @@ def get_supabase():
     return supabase_admin
 
 
+def verify_connection() -> bool:
+    """
+    Check that Supabase is configured and reachable with a one-row query.
+    Returns True on success, False otherwise.
+    """
+    if supabase_admin is None:
+        return False
+    try:
+        supabase_admin.table("pdfs").select("id").limit(1).execute()
+        return True
+    except Exception:
+        return False
+
+
+async def close_supabase():
+    """
+    Close the keep-alive HTTP connections shared by the Supabase clients.
+    """
+    from supabase_lite import aclose_http_client, close_http_client
+    close_http_client()
+    await aclose_http_client()
+
+
 # ---------------------------------------------------------------------------
 # Run on import
 # ---------------------------------------------------------------------------
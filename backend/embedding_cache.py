@@ -0,0 +1,184 @@
+"""
+Embedding Cache for MINI-RAG Backend
+
+Content-addressed cache of embedding vectors, so identical chunks are not sent to
+the embedding API again when a PDF is re-indexed or re-uploaded. Keys are
+sha256(model + "\\0" + text). A second key hashes the text after NFKC folding,
+lowercasing and dropping punctuation/whitespace, so chunks that differ only by
+such edits also reuse the stored vector. Lookups go to a per-process LRU first,
+then to the Supabase ``embedding_cache`` table.
+
+Exports:
+- content_hash: Exact cache key for a (model, text) pair.
+- normalized_hash: Edit-tolerant cache key for a (model, text) pair.
+- get_many: Fetch cached vectors for a list of texts.
+- put_many: Store new vectors in both cache tiers.
+"""
+from array import array
+from collections import OrderedDict
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+
+import orjson
+
+EMBEDDING_CACHE_TABLE = "embedding_cache"
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+EMBEDDING_CACHE_L1_SIZE = int(os.getenv("EMBEDDING_CACHE_L1_SIZE", "4096"))
+LOOKUP_BATCH_KEYS = 100        # keys per IN (...) filter, keeps the request URL short
+TABLE_RETRY_SECONDS = 300      # back off from the table after a failed request
+
+logger = logging.getLogger(__name__)
+
+_NON_WORD_RE = re.compile(r"[\W_]+")
+
+_l1 = OrderedDict()            # key -> float32 array vector, most recently used last
+_l1_lock = threading.Lock()
+_table_disabled_until = 0.0
+
+
+def content_hash(model: str, text: str) -> str:
+    """
+    Return the cache key for a text embedded with the given model.
+    """
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+
+def normalized_hash(model: str, text: str):
+    """
+    Return the edit-tolerant cache key for a text, or None if nothing is left after
+    normalization.
+    """
+    folded = _NON_WORD_RE.sub("", unicodedata.normalize("NFKC", text).lower())
+    if not folded:
+        return None
+    return hashlib.sha256(f"{model}\0norm\0{folded}".encode("utf-8")).hexdigest()
+
+
+def _l1_get(key: str):
+    with _l1_lock:
+        vector = _l1.get(key)
+        if vector is not None:
+            _l1.move_to_end(key)
+        return vector
+
+
+def _l1_put(key: str, vector):
+    with _l1_lock:
+        _l1[key] = vector
+        _l1.move_to_end(key)
+        while len(_l1) > EMBEDDING_CACHE_L1_SIZE:
+            _l1.popitem(last=False)
+
+
+def _table_available() -> bool:
+    return EMBEDDING_CACHE_ENABLED and time.monotonic() >= _table_disabled_until
+
+
+def _disable_table(exc: Exception):
+    global _table_disabled_until
+    _table_disabled_until = time.monotonic() + TABLE_RETRY_SECONDS
+    logger.warning("Embedding cache table unavailable, retrying in %ds: %s", TABLE_RETRY_SECONDS, exc)
+
+
+def _fetch(sb, column: str, keys: list) -> dict:
+    """
+    Fetch vectors from the cache table where `column` matches one of `keys`.
+    """
+    found = {}
+    for i in range(0, len(keys), LOOKUP_BATCH_KEYS):
+        resp = (
+            sb.table(EMBEDDING_CACHE_TABLE)
+            .select(f"{column}, embedding_json")
+            .in_(column, keys[i:i + LOOKUP_BATCH_KEYS])
+            .execute()
+        )
+        for row in resp.data or []:
+            found[row[column]] = array("f", orjson.loads(row["embedding_json"]))
+    return found
+
+
+def get_many(sb, model: str, texts: list):
+    """
+    Look up cached vectors for texts embedded with `model`, by exact key first and
+    then by normalized key. Blank texts are skipped.
+    Returns (vectors aligned with `texts`, indices of non-blank texts not found).
+    """
+    vectors = [None] * len(texts)
+    missing = []   # (index, exact key, normalized key)
+    for i, text in enumerate(texts):
+        if not text.strip():
+            continue
+        if not EMBEDDING_CACHE_ENABLED:
+            missing.append((i, None, None))
+            continue
+        key = content_hash(model, text)
+        vector = _l1_get(key)
+        if vector is None:
+            norm_key = normalized_hash(model, text)
+            vector = _l1_get(norm_key) if norm_key else None
+            if vector is None:
+                missing.append((i, key, norm_key))
+                continue
+        vectors[i] = vector
+
+    if missing and EMBEDDING_CACHE_ENABLED and sb is not None and _table_available():
+        try:
+            for column, position in (("content_hash", 1), ("normalized_hash", 2)):
+                keys = [entry[position] for entry in missing if entry[position]]
+                if not keys:
+                    break
+                found = _fetch(sb, column, list(dict.fromkeys(keys)))
+                still_missing = []
+                for entry in missing:
+                    vector = found.get(entry[position])
+                    if vector is None:
+                        still_missing.append(entry)
+                    else:
+                        vectors[entry[0]] = vector
+                        _l1_put(entry[1], vector)
+                missing = still_missing
+                if not missing:
+                    break
+        except Exception as exc:
+            _disable_table(exc)
+
+    return vectors, [entry[0] for entry in missing]
+
+
+def _encode(vector) -> str:
+    return orjson.dumps(list(vector)).decode()
+
+
+def put_many(sb, model: str, vectors: dict, encode=_encode):
+    """
+    Store freshly computed vectors (text -> vector) in the LRU and upsert them into
+    the cache table. `encode` turns a vector into the stored JSON text.
+    """
+    if not EMBEDDING_CACHE_ENABLED or not vectors:
+        return
+
+    rows = []
+    for text, vector in vectors.items():
+        key = content_hash(model, text)
+        norm_key = normalized_hash(model, text)
+        _l1_put(key, vector)
+        if norm_key:
+            _l1_put(norm_key, vector)
+        rows.append({
+            "content_hash": key,
+            "normalized_hash": norm_key,
+            "model": model,
+            "embedding_json": encode(vector),
+        })
+
+    if sb is None or not _table_available():
+        return
+    try:
+        sb.table(EMBEDDING_CACHE_TABLE).upsert(rows, returning="minimal").execute()
+    except Exception as exc:
+        _disable_table(exc)
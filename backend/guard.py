@@ -0,0 +1,48 @@
+"""
+Input Validation for MINI-RAG Backend
+
+Validators for user-supplied filenames and search queries that run on every
+upload and search request. All patterns are compiled once at import time.
+
+Exports:
+- validate_filename: Accepts a plain ``*.pdf`` filename safe to embed in a storage path.
+- validate_query: Normalizes a search query and enforces its length limits.
+"""
+import re
+
+MAX_FILENAME_LENGTH = 255
+MAX_QUERY_LENGTH = 1000
+
+# Control characters other than tab and newline are dropped from queries;
+# str.translate does this in one C-level pass.
+_CONTROL_CHARS = dict.fromkeys(c for c in (*range(32), 127) if c not in (9, 10))
+
+# Any name ending in .pdf without path separators, URL metacharacters or control
+# characters, since the name becomes part of the storage key.
+_FILENAME_RE = re.compile(r'[^/\\?#%&*:"<>|\x00-\x1f]+\.pdf', re.IGNORECASE)
+
+
+def validate_filename(filename: str) -> str:
+    """
+    Validate an uploaded PDF filename.
+    Returns the filename, or raises ValueError if it is not an acceptable PDF name.
+    """
+    if not filename or len(filename) > MAX_FILENAME_LENGTH:
+        raise ValueError("Invalid filename")
+    if not _FILENAME_RE.fullmatch(filename):
+        raise ValueError("Only PDF files with a plain filename are allowed")
+    return filename
+
+
+def validate_query(query: str) -> str:
+    """
+    Validate a search query.
+    Returns the query with control characters and surrounding whitespace removed,
+    or raises ValueError.
+    """
+    query = (query or "").translate(_CONTROL_CHARS).strip()
+    if not query:
+        raise ValueError("Query must not be empty")
+    if len(query) > MAX_QUERY_LENGTH:
+        raise ValueError(f"Query must be at most {MAX_QUERY_LENGTH} characters")
+    return query
@@ -15,8 +15,9 @@ All persistent data is stored in Supabase PostgreSQL.
 Routers are imported from the backend/routers/ directory.
 """
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse
 from starlette.middleware.base import BaseHTTPMiddleware
+import asyncio
 import time
 from collections import defaultdict, deque
 
@@ -65,13 +66,63 @@ load_dotenv()
 
 # Import routers (absolute imports for Vercel)
 from routers import auth, users, feedback, student_feedback, rag, analytics, chat
+from database import verify_connection, close_supabase
+
+# --- Health check cache: probes hit memory, not Supabase/Gemini, within the TTL ---
+HEALTH_CACHE_TTL = float(os.getenv("HEALTH_CACHE_TTL", "10"))  # seconds
+HEALTH_CHECK_TIMEOUT = float(os.getenv("HEALTH_CHECK_TIMEOUT", "2"))  # seconds per upstream probe
+EMBEDDINGS_HEALTH_TTL = float(os.getenv("EMBEDDINGS_HEALTH_TTL", "60"))  # seconds; each probe is a paid embed call
+_health_cache = {}  # checker name -> (value, expiry)
+_health_probes = {}  # checker name -> running probe task
+
+def _cached(ttl: float):
+    """
+    Cache a blocking check's result for `ttl` seconds and run it off the event loop.
+    At most one probe per check runs at a time; it is shielded from the caller's
+    timeout, so a slow probe still finishes and fills the cache (an error counts as
+    False) instead of every later request starting another one.
+    """
+    def decorator(check):
+        name = check.__name__
+
+        def store(task):
+            _health_probes.pop(name, None)
+            ok = not task.cancelled() and task.exception() is None and task.result()
+            _health_cache[name] = (bool(ok), time.monotonic() + ttl)
+
+        async def wrapper():
+            cached = _health_cache.get(name)
+            if cached and cached[1] > time.monotonic():
+                return cached[0]
+            task = _health_probes.get(name)
+            if task is None:
+                task = asyncio.ensure_future(asyncio.to_thread(check))
+                _health_probes[name] = task
+                task.add_done_callback(store)
+            return await asyncio.shield(task)
+        return wrapper
+    return decorator
+
+async def _probe(check) -> bool:
+    """Run a health check, treating a timeout or error as a failed check."""
+    try:
+        return await asyncio.wait_for(check(), timeout=HEALTH_CHECK_TIMEOUT)
+    except Exception:
+        return False
+
+check_supabase = _cached(HEALTH_CACHE_TTL)(verify_connection)
+check_embeddings = _cached(EMBEDDINGS_HEALTH_TTL)(rag.verify_embeddings_setup)
+
+# Warm clients, connection pools and the search path on startup (costs one embed call)
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "true").lower() in ("1", "true", "yes")
 
 # Create FastAPI app
 
 app = FastAPI(
     title="EduRag API",
     description="Backend API for EduRag - Educational RAG Platform",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
 )
 
 # Global error handler for HTTPException and generic Exception
@@ -92,16 +143,21 @@ async def generic_exception_handler(request: Request, exc: Exception):
 app.add_middleware(RateLimitMiddleware)
 app.add_middleware(SecurityHeadersMiddleware)
 
-# CORS configuration - Allow Vercel frontend + dev origins + Codespaces
+# CORS configuration - Allow Vercel frontend + dev origins + Codespaces.
+# CORSMiddleware answers preflight OPTIONS requests itself; a frozenset keeps the
+# exact-origin check O(1).
+ALLOWED_ORIGINS = frozenset({
+    "http://localhost:3000",
+    "http://127.0.0.1:3000",
+    "http://localhost:8000",
+    "http://127.0.0.1:8000",
+})
+ALLOWED_ORIGIN_REGEX = r"https://.*(\.vercel\.app|\.app\.github\.dev|\.preview\.app\.github\.dev)"
+
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=[
-        "http://localhost:3000",
-        "http://127.0.0.1:3000",
-        "http://localhost:8000",
-        "http://127.0.0.1:8000",
-    ],
-    allow_origin_regex=r"https://.*(\.vercel\.app|\.app\.github\.dev|\.preview\.app\.github\.dev)",
+    allow_origins=ALLOWED_ORIGINS,
+    allow_origin_regex=ALLOWED_ORIGIN_REGEX,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
@@ -120,9 +176,43 @@ ROOT_DIR = Path(__file__).resolve().parent.parent
 FRONTEND_BUILD_DIR = ROOT_DIR / "build"
 FRONTEND_STATIC_DIR = FRONTEND_BUILD_DIR / "static"
 
+@app.on_event("startup")
+async def startup_event():
+    # Build the shared Gemini client up front so the first request does not pay for it
+    rag._get_gemini_client()
+    if not STARTUP_WARMUP:
+        return
+    started = time.perf_counter()
+    supabase_ok, timings = await asyncio.gather(check_supabase(), asyncio.to_thread(rag.warm_up))
+    timings["supabase"] = supabase_ok
+    print(f"🔥 Warm-up finished in {(time.perf_counter() - started) * 1000:.0f} ms: {timings}")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    rag.shutdown_pdf_pool()
+    await close_supabase()
+
 @app.get("/api/health")
 async def health_check():
-    return {"status": "healthy"}
+    supabase_ok, embeddings_ok = await asyncio.gather(
+        _probe(check_supabase), _probe(check_embeddings)
+    )
+    return {
+        "status": "healthy" if supabase_ok and embeddings_ok else "degraded",
+        "supabase": supabase_ok,
+        "embeddings": embeddings_ok,
+    }
+
+# Liveness: no upstream calls, safe for high-frequency probes
+@app.get("/api/healthz")
+async def liveness_check():
+    return {"status": "ok", "gemini_configured": rag._get_gemini_client() is not None}
+
+# Readiness: the cached upstream probes, with 503 so load balancers stop routing
+@app.get("/api/readyz")
+async def readiness_check():
+    health = await health_check()
+    return ORJSONResponse(health, status_code=200 if health["status"] == "healthy" else 503)
 
 if FRONTEND_BUILD_DIR.exists():
     if FRONTEND_STATIC_DIR.exists():
@@ -155,4 +245,13 @@ else:
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # loop/http "auto" pick uvloop and httptools when installed (uvicorn[standard]);
+    # workers need the import string rather than the app object.
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="auto",
+        http="auto",
+        workers=int(os.getenv("WEB_CONCURRENCY", min(os.cpu_count() or 1, 4))),
+    )
@@ -101,6 +101,10 @@ class FeedbackUpdate(BaseModel):
 class RAGQuery(BaseModel):
     query: str
     language: str = "english"
+    top_k: Optional[int] = None   # number of chunks to retrieve; server default if unset
+
+class BulkQARequest(BaseModel):
+    queries: List[str]
 
 class RAGResult(BaseModel):
     id: int
@@ -108,12 +112,16 @@ class RAGResult(BaseModel):
     source: str
     relevance_score: float
     page_number: Optional[int] = None
+    token_count: Optional[int] = None
 
 class RAGResponse(BaseModel):
     query: str
     results: List[RAGResult]
     total_results: int
     response_time_ms: int
+    retrieval_mode: str = "keyword"
+    used_multimodal: bool = False
+    generated_answer: Optional[str] = None
 
 class SearchHistory(BaseModel):
     id: int
@@ -9,7 +9,7 @@ from fastapi import APIRouter, HTTPException, Depends
 from datetime import datetime, timedelta
 
 from database import get_supabase
-from routers.auth import get_current_user
+from routers.auth import STAFF_ROLES, get_current_user
 
 router = APIRouter()
 
@@ -110,7 +110,7 @@ async def get_daily_queries(days: int = 30, current_user: dict = Depends(get_cur
 
 @router.get("/student-insights")
 async def get_student_insights(current_user: dict = Depends(get_current_user)):
-    if current_user.get("role") not in ["admin", "teacher"]:
+    if current_user.get("role") not in STAFF_ROLES:
         raise HTTPException(status_code=403, detail="Only teachers and admins can view insights")
     try:
         sb = get_supabase()
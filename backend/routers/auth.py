@@ -26,6 +26,9 @@ JWT_SECRET = os.getenv("JWT_SECRET", "your-secret-key")
 JWT_ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "60"))
 
+USER_ROLES = frozenset(role.value for role in UserRole)
+STAFF_ROLES = frozenset({UserRole.teacher.value, UserRole.admin.value})   # may manage PDFs, users and analytics
+
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """
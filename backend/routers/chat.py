@@ -6,10 +6,12 @@ Provides endpoints for student chatroom functionality. Messages are auto-deleted
 Includes message creation and retrieval endpoints. Only students can send messages.
 """
 from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 from typing import List
 from datetime import datetime, timedelta
 import os
+import time
 
 from database import get_supabase
 from routers.auth import get_current_user
@@ -17,6 +19,21 @@ from routers.auth import get_current_user
 router = APIRouter()
 
 CHAT_MESSAGE_LIFETIME = int(os.getenv('CHAT_MESSAGE_LIFETIME', 60))  # seconds
+CHAT_HISTORY_WINDOW = timedelta(hours=1)
+
+_cutoff_cache = (0, "")  # (epoch second, ISO cutoff string)
+
+
+def _history_cutoff_iso() -> str:
+    """
+    Return the ISO timestamp CHAT_HISTORY_WINDOW ago at second resolution.
+    The string is rebuilt at most once per second, however often the chat is polled.
+    """
+    global _cutoff_cache
+    now = int(time.time())
+    if _cutoff_cache[0] != now:
+        _cutoff_cache = (now, (datetime.utcfromtimestamp(now) - CHAT_HISTORY_WINDOW).isoformat())
+    return _cutoff_cache[1]
 
 class ChatMessageCreate(BaseModel):
     message: str
@@ -48,15 +65,22 @@ async def send_message(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.get("/messages", response_model=List[ChatMessageOut])
+# Polled by the chatroom UI: rows are selected in ChatMessageOut's exact shape and
+# returned as-is, so the model only documents the schema instead of re-validating.
+@router.get("/messages", responses={200: {"model": List[ChatMessageOut]}})
 async def get_messages(current_user: dict = Depends(get_current_user)):
     if current_user.get("role") != "student":
         raise HTTPException(status_code=403, detail="Only students can view messages")
     try:
         sb = get_supabase()
-        cutoff = datetime.utcnow() - timedelta(hours=1)
-        resp = sb.table("chat_messages").select("*").gte("created_at", cutoff.isoformat()).order("created_at", desc=False).execute()
-        return resp.data or []
+        resp = (
+            sb.table("chat_messages")
+            .select("id, sender_id, sender_name, message, created_at")
+            .gte("created_at", _history_cutoff_iso())
+            .order("created_at", desc=False)
+            .execute()
+        )
+        return ORJSONResponse(resp.data or [])
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -83,8 +107,7 @@ async def cleanup_old_messages():
     """
     try:
         sb = get_supabase()
-        cutoff = datetime.utcnow() - timedelta(hours=1)
-        resp = sb.table("chat_messages").delete().lt("created_at", cutoff.isoformat()).execute()
+        resp = sb.table("chat_messages").delete().lt("created_at", _history_cutoff_iso()).execute()
         return {"deleted": resp.count}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
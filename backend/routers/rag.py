@@ -6,41 +6,168 @@ Provides endpoints for Retrieval-Augmented Generation (RAG) document search, PDF
 All PDFs are uploaded to the Supabase Storage bucket "pdfs". No local storage is used.
 """
 from fastapi import APIRouter, HTTPException, Depends, UploadFile, File
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from typing import List, Optional
 from datetime import datetime
+from array import array
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from itertools import repeat
+from operator import mul
+import asyncio
+import hashlib
+import heapq
+import logging
 import os
+import random
+import re
 import time
-import json
 import math
+import mmap
 import tempfile
 
-from models import RAGQuery
+import orjson
+
+from models import BulkQARequest, RAGQuery, RAGResponse
 from database import get_supabase
-from routers.auth import get_current_user
+from guard import validate_filename, validate_query
+import answer_cache
+import embedding_cache
+from routers.auth import STAFF_ROLES, get_current_user
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 STORAGE_BUCKET = "pdfs"   # Supabase Storage bucket name
+MAX_PDF_UPLOAD_BYTES = int(os.getenv("MAX_PDF_UPLOAD_MB", "50")) * 1024 * 1024
+UPLOAD_READ_CHUNK_BYTES = 1 << 20          # stream uploads in 1 MiB pieces
+UPLOAD_SPOOL_MAX_BYTES = 8 * 1024 * 1024   # spill to disk above 8 MiB
 
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
 EMBEDDING_MODEL = os.getenv("GEMINI_EMBEDDING_MODEL", "gemini-embedding-001")
+EMBEDDING_DIM = int(os.getenv("GEMINI_EMBEDDING_DIM", "3072"))   # must match the halfvec(3072) column
 MULTIMODAL_EMBEDDING_MODEL = os.getenv("GEMINI_MULTIMODAL_EMBEDDING_MODEL", "")
 GENERATION_MODEL = os.getenv("GEMINI_GENERATION_MODEL", "models/gemini-3-flash-preview")
 GENERATION_MODEL_FALLBACK = os.getenv("GEMINI_GENERATION_MODEL_FALLBACK", "models/gemini-2.5-flash")
+# Models tried in order for every generation call (an unset or repeated fallback is skipped)
+GENERATION_MODELS = tuple(dict.fromkeys(m for m in (GENERATION_MODEL, GENERATION_MODEL_FALLBACK) if m))
+GEMINI_TIMEOUT_MS = int(os.getenv("GEMINI_TIMEOUT_MS", "30000"))   # per HTTP request; the SDK default never times out
+# The embeddings health probe must give up about when main.py stops waiting for it
+HEALTH_PROBE_TIMEOUT_MS = int(float(os.getenv("HEALTH_CHECK_TIMEOUT", "2")) * 1000)
+# Transient Gemini failures (429 / 5xx) are retried with jittered exponential backoff
+GEMINI_MAX_ATTEMPTS = int(os.getenv("GEMINI_MAX_ATTEMPTS", "5"))
+GEMINI_RETRY_MAX_SECONDS = 30.0
+GENERATION_MAX_ATTEMPTS = int(os.getenv("GEMINI_GENERATION_MAX_ATTEMPTS", "3"))   # per model, keeps searches responsive
+
+ANSWER_SYSTEM_PROMPT = (
+    "You are EduRag, an intelligent educational RAG (Retrieval-Augmented Generation) assistant.\n"
+    "Your job is to generate a clear, helpful, and well-structured answer based ONLY on the retrieved context "
+    "provided with the student's question.\n"
+    "IMPORTANT RULES:\n"
+    "1. Synthesize the information into a coherent answer — do NOT just copy-paste chunks.\n"
+    "2. At the END of your answer, add a 'Sources:' section listing which sources you used "
+    "(e.g., 'Sources: Source 1 (filename.pdf, Page 3), Source 2 (filename.pdf, Page 7)').\n"
+    "3. If the context does not contain enough info, say so clearly.\n"
+    "4. Keep the answer educational, concise, and well-formatted."
+)
+NO_RESULTS_ANSWER = (
+    "No relevant results found for \"{query}\". The indexed PDFs may not contain information on this topic. "
+    "Try a different query or ask your teacher to upload relevant course materials."
+)
+CAPTION_PROMPT = (
+    "You are helping index educational PDFs for retrieval. "
+    "Describe this image in concise, factual terms with learning-relevant details."
+)
+
+# PDF extraction strategy: small files are parsed serially, larger ones are split
+# into page batches and fanned out over a process pool (set workers to 1 to disable).
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", str(os.cpu_count() or 1)))
+PDF_SERIAL_PAGE_LIMIT = 10
+PDF_PAGES_PER_TASK = 20
+
+# Chunking: "paragraph" and "sentence" pack whole units into each chunk (fewer chunks,
+# fewer embedding calls); "fixed" is plain overlapping character windows.
+CHUNK_STRATEGY = os.getenv("RAG_CHUNK_STRATEGY", "paragraph").lower()
+# Chunk budgets are set in tokens of the embedding model and converted with a
+# chars-per-token estimate (avoids shipping a tokenizer). gemini-embedding-001
+# accepts 2048 input tokens; chunks are capped at 90% of that.
+EMBEDDING_MAX_TOKENS = 2048
+CHARS_PER_TOKEN = 4
+CHUNK_TOKENS = min(int(os.getenv("RAG_CHUNK_TOKENS", "225")), int(EMBEDDING_MAX_TOKENS * 0.9))
+CHUNK_OVERLAP_TOKENS = min(int(os.getenv("RAG_CHUNK_OVERLAP_TOKENS", "30")), CHUNK_TOKENS // 2)
+CHUNK_SIZE_CHARS = CHUNK_TOKENS * CHARS_PER_TOKEN
+CHUNK_OVERLAP_CHARS = CHUNK_OVERLAP_TOKENS * CHARS_PER_TOKEN
+BOUNDARY_SNAP_CHARS = 100   # how far back a fixed-size chunk end may move to a boundary
+# Hiragana/katakana, CJK ideographs and Hangul: roughly one token per character
+_WIDE_CHAR_RE = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]")
+_CHUNK_SPLITTERS = {
+    "paragraph": re.compile(r"\n\s*\n"),
+}
+
+SIMILARITY_THRESHOLD = 0.65   # minimum cosine similarity — below this, results are noise
+SEARCH_TOP_K = 5
+SEARCH_MAX_TOP_K = 50          # upper bound for a caller-supplied top_k
+RESULT_CONTENT_CHARS = 700   # chunk text shown per result; match_rag_chunks cuts to the same length
+MAX_CONTEXT_TOKENS = int(os.getenv("RAG_MAX_CONTEXT_TOKENS", "4000"))   # retrieved text per answer prompt
+SIMHASH_MAX_DISTANCE = 6   # of 64 bits: closer retrieved chunks count as near-duplicates
+# Queries whose best chunk scores below this are answered with the canned reply
+ANSWER_MIN_SIMILARITY = float(os.getenv("RAG_ANSWER_MIN_SIMILARITY", str(SIMILARITY_THRESHOLD)))
+# Short queries with a match this strong are answered from the top chunk only
+FOCUSED_ANSWER_SIMILARITY = float(os.getenv("RAG_FOCUSED_ANSWER_SIMILARITY", "0.85"))
+FOCUSED_QUERY_MAX_WORDS = 4
+BULK_QA_MAX_QUERIES = 50
+BULK_GENERATION_CONCURRENCY = int(os.getenv("GEMINI_BULK_GENERATION_CONCURRENCY", "4"))
+BULK_RETRIEVAL_CONCURRENCY = 8   # concurrent Supabase searches per bulk request
+MATCH_RPC_RETRY_SECONDS = 300  # back off from the pgvector RPC after it fails
+# Search the binary-quantized index and re-rank candidates at full precision
+QUANTIZED_SEARCH = os.getenv("RAG_QUANTIZED_SEARCH", "false").lower() in ("1", "true", "yes")
+QUANTIZED_OVERSAMPLE = int(os.getenv("RAG_QUANTIZED_OVERSAMPLE", "10"))
+
+# Embeddings are stored as halfvec (~3 significant digits), so sending full float64
+# reprs over the wire is wasted bytes; round to this many decimals when serializing.
+EMBEDDING_JSON_DECIMALS = int(os.getenv("EMBEDDING_JSON_DECIMALS", "6"))
+
+# Indexing requests allowed to run at once; the rest wait their turn
+INGEST_SEMAPHORE = asyncio.Semaphore(int(os.getenv("MAX_CONCURRENT_INGESTS", "4")))
+INDEX_QUEUE_SIZE = 4   # bounded queues give backpressure between indexing pipeline stages
+INDEX_EMBED_WORKERS = 3
+INDEX_STORE_WORKERS = 2
+EMBED_BATCH_SIZE = int(os.getenv("GEMINI_EMBED_BATCH_SIZE", "64"))   # API limit is 100 per call
+EMBED_MAX_CONCURRENCY = int(os.getenv("GEMINI_EMBED_MAX_CONCURRENCY", "16"))
+IMAGE_MAX_PER_PAGE = 4   # images captioned/embedded per page
+IMAGE_WORKERS = int(os.getenv("GEMINI_IMAGE_WORKERS", "8"))
+INSERT_BATCH_ROWS = 500   # rows per bulk insert request, well under the PostgREST payload cap
+INSERT_MAX_CONCURRENCY = int(os.getenv("SUPABASE_INSERT_MAX_CONCURRENCY", "8"))
+
+_pdf_pool = None
+_image_pool = None
+_gemini_client = None          # shared Gemini client, created once per process
+_gemini_client_ready = False
+_match_rpc_disabled_until = 0.0
+_answer_stats = Counter()      # answer outcome -> count, see get_answer_stats()
+_background_writes = set()     # cache write-backs still running off the request path
 
 
 def _get_gemini_client():
     """
-    Initialize and return a Gemini API client using the API key from environment variables.
-    Returns None if the API key is not set or the client cannot be created.
+    Return the shared Gemini API client, creating it on first use from the API key
+    in the environment. Returns None if the API key is not set or the client cannot be created.
     """
-    api_key = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
-    if not api_key:
-        return None
-    try:
-        from google import genai
-        return genai.Client(api_key=api_key)
-    except Exception:
-        return None
+    global _gemini_client, _gemini_client_ready
+    if _gemini_client_ready:
+        return _gemini_client
+    if GEMINI_API_KEY:
+        try:
+            from google import genai
+            _gemini_client = genai.Client(
+                api_key=GEMINI_API_KEY,
+                http_options={"timeout": GEMINI_TIMEOUT_MS},
+            )
+        except Exception:
+            _gemini_client = None
+    _gemini_client_ready = True
+    return _gemini_client
 
 
 def _safe_mime_type(image_bytes: bytes) -> str:
@@ -56,19 +183,72 @@ def _safe_mime_type(image_bytes: bytes) -> str:
     return "application/octet-stream"
 
 
-def _extract_text_and_images_from_pdf(pdf_path: str):
+def _get_pdf_pool():
+    """
+    Return the shared process pool used for PDF page extraction, creating it on first use.
+    Returns None if process pools are unavailable (e.g. serverless runtimes).
+    """
+    global _pdf_pool
+    if _pdf_pool is None and PDF_EXTRACT_WORKERS > 1:
+        try:
+            _pdf_pool = ProcessPoolExecutor(max_workers=PDF_EXTRACT_WORKERS)
+        except (OSError, NotImplementedError):
+            return None
+    return _pdf_pool
+
+
+def _get_image_pool() -> ThreadPoolExecutor:
     """
-    Extract text and images from a local PDF file path.
-    Returns a list of pages, each with text and images, and the total number of pages.
+    Return the shared thread pool for per-image Gemini calls, creating it on first use.
+    """
+    global _image_pool
+    if _image_pool is None:
+        _image_pool = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="rag-image")
+    return _image_pool
+
+
+def shutdown_pdf_pool():
+    """
+    Shut down the PDF extraction process pool and the image thread pool
+    (called on application shutdown).
+    """
+    global _pdf_pool, _image_pool
+    if _pdf_pool is not None:
+        _pdf_pool.shutdown(cancel_futures=True)
+        _pdf_pool = None
+    if _image_pool is not None:
+        _image_pool.shutdown(cancel_futures=True)
+        _image_pool = None
+
+
+def _open_pdf_reader(pdf_path: str):
+    """
+    Open a PdfReader over a read-only memory map of a local PDF file.
+    Given a path, pypdf copies the whole file into a BytesIO; the map lets the OS
+    page the file in on demand instead.
     """
-    pages = []
     try:
         from pypdf import PdfReader
     except Exception as exc:
         raise RuntimeError("pypdf is required for PDF parsing") from exc
+    try:
+        with open(pdf_path, "rb") as fh:
+            mapped = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return PdfReader(pdf_path)  # empty file or mmap unsupported here
+    return PdfReader(mapped)
+
+
+def _iter_page_range(pdf_path: str, start: int, stop: int, reader=None):
+    """
+    Yield text and images for pages [start, stop) of a local PDF file, one page at a time.
+    Re-opens the file unless a reader is passed in.
+    """
+    if reader is None:
+        reader = _open_pdf_reader(pdf_path)
 
-    reader = PdfReader(pdf_path)
-    for page_number, page in enumerate(reader.pages, start=1):
+    for index in range(start, stop):
+        page = reader.pages[index]
         page_text = (page.extract_text() or "").strip()
         page_images = []
         try:
@@ -78,13 +258,66 @@ def _extract_text_and_images_from_pdf(pdf_path: str):
         except Exception:
             page_images = []
 
-        pages.append({
-            "page_number": page_number,
+        yield {
+            "page_number": index + 1,
             "text": page_text,
             "images": page_images,
-        })
+        }
+
+
+def _extract_page_range(pdf_path: str, start: int, stop: int):
+    """
+    Extract pages [start, stop) of a local PDF file as a list (process pool task).
+    """
+    return list(_iter_page_range(pdf_path, start, stop))
+
+
+def _iter_pages_parallel(pool, pdf_path: str, total_pages: int):
+    """
+    Fan page batches out over the process pool and yield pages in page order.
+    Only a bounded number of batches is kept in flight, so extraction stays just
+    ahead of the consumer instead of buffering the whole document.
+    """
+    max_in_flight = PDF_EXTRACT_WORKERS * 2
+    pending = deque()
+    for start in range(0, total_pages, PDF_PAGES_PER_TASK):
+        stop = min(start + PDF_PAGES_PER_TASK, total_pages)
+        pending.append(pool.submit(_extract_page_range, pdf_path, start, stop))
+        if len(pending) >= max_in_flight:
+            yield from pending.popleft().result()
+    while pending:
+        yield from pending.popleft().result()
+
+
+def _iter_pdf_pages(pdf_path: str, reader, total_pages: int):
+    """
+    Yield the pages of a local PDF file in order. Files above PDF_SERIAL_PAGE_LIMIT
+    pages are parsed in parallel page batches; if the pool breaks, the remaining
+    pages are parsed serially.
+    """
+    next_index = 0
+    if total_pages > PDF_SERIAL_PAGE_LIMIT:
+        pool = _get_pdf_pool()
+        if pool is not None:
+            try:
+                for page_info in _iter_pages_parallel(pool, pdf_path, total_pages):
+                    yield page_info
+                    next_index = page_info["page_number"]
+            except Exception:
+                pass  # broken pool — continue serially below
 
-    return pages, len(reader.pages)
+    yield from _iter_page_range(pdf_path, next_index, total_pages, reader=reader)
+
+
+def _open_pdf_pages(pdf_path: str):
+    """
+    Open a local PDF file for streaming extraction.
+    Returns the total number of pages and an iterator over the page dicts, so
+    pages can be indexed as they are parsed instead of after the whole file.
+    """
+    reader = _open_pdf_reader(pdf_path)
+    total_pages = len(reader.pages)
+    return total_pages, _iter_pdf_pages(pdf_path, reader, total_pages)
 
 
 def _download_pdf_from_storage(sb, storage_path: str) -> str:
@@ -92,10 +325,13 @@ def _download_pdf_from_storage(sb, storage_path: str) -> str:
     Download a PDF from Supabase Storage to a temporary file.
     Returns the temporary file path.
     """
-    data = sb.storage.from_(STORAGE_BUCKET).download(storage_path)
-    tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf")
-    tmp.write(data)
-    tmp.close()
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
+        try:
+            sb.storage.from_(STORAGE_BUCKET).download_to(storage_path, tmp)
+        except Exception:
+            tmp.close()
+            os.unlink(tmp.name)
+            raise
     return tmp.name
 
 
@@ -112,7 +348,59 @@ def _ensure_storage_bucket(sb):
             pass  # bucket may already exist
 
 
-def _embed_text(client, text: str):
+@lru_cache(maxsize=1)
+def _embed_config(timeout_ms: int = None):
+    """
+    Return the embedding request config, which asks Gemini for EMBEDDING_DIM dimensions.
+    `timeout_ms` overrides the client's GEMINI_TIMEOUT_MS for this request.
+    """
+    from google.genai import types
+    if timeout_ms:
+        return types.EmbedContentConfig(
+            output_dimensionality=EMBEDDING_DIM, http_options={"timeout": timeout_ms},
+        )
+    return types.EmbedContentConfig(output_dimensionality=EMBEDDING_DIM)
+
+
+def _retry_delay(exc, attempt: int):
+    """
+    Return how long to wait before retrying a failed Gemini call, or None if the
+    error is not transient. Honors Retry-After on 429, else uses full jitter.
+    """
+    code = getattr(exc, "code", None)
+    if not isinstance(code, int) or not (code == 429 or code >= 500):
+        return None
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        retry_after = float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        retry_after = None
+    if retry_after is not None:
+        return min(retry_after, GEMINI_RETRY_MAX_SECONDS)
+    return random.uniform(0, min(GEMINI_RETRY_MAX_SECONDS, 2 ** attempt))
+
+
+def _embed_content(client, contents, attempts: int = GEMINI_MAX_ATTEMPTS, timeout_ms: int = None):
+    """
+    Call embed_content, retrying rate-limit and server errors up to `attempts`
+    times so one transient failure does not drop a batch.
+    """
+    for attempt in range(attempts):
+        try:
+            return client.models.embed_content(
+                model=EMBEDDING_MODEL,
+                contents=contents,
+                config=_embed_config(timeout_ms),
+            )
+        except Exception as e:
+            delay = _retry_delay(e, attempt)
+            if delay is None or attempt + 1 == attempts:
+                raise
+            logger.warning("Embedding call failed (%s), retrying in %.1fs", e, delay)
+            time.sleep(delay)
+
+
+def _embed_text(client, text: str, attempts: int = GEMINI_MAX_ATTEMPTS, timeout_ms: int = None):
     """
     Generate an embedding vector for the given text using the Gemini client.
     Returns the embedding vector or None if embedding fails.
@@ -120,17 +408,199 @@ def _embed_text(client, text: str):
     if not client or not text.strip():
         return None
     try:
-        response = client.models.embed_content(
-            model=EMBEDDING_MODEL,
-            contents=text,
-        )
+        response = _embed_content(client, text, attempts, timeout_ms)
         if hasattr(response, "embeddings") and response.embeddings:
-            return response.embeddings[0].values
-        if hasattr(response, "embedding") and response.embedding:
-            return response.embedding.values
+            vector = _pack_vector(response.embeddings[0].values)
+        elif hasattr(response, "embedding") and response.embedding:
+            vector = _pack_vector(response.embedding.values)
+        else:
+            return None
     except Exception:
         return None
-    return None
+    if len(vector) != EMBEDDING_DIM:
+        logger.warning("Embedding has %d dims, expected %d", len(vector), EMBEDDING_DIM)
+        return None
+    return vector
+
+
+def _pack_vector(values):
+    """
+    Store an embedding as a contiguous float32 array (4 bytes per value instead of
+    a 24-byte float object plus an 8-byte list slot). Precision is still above the
+    halfvec column's.
+    """
+    return array("f", values)
+
+
+def _quantize_vector(vector):
+    """
+    Round an embedding to EMBEDDING_JSON_DECIMALS decimals, matching the precision
+    kept by the halfvec column, so payloads and embedding_json stay compact.
+    """
+    return [round(v, EMBEDDING_JSON_DECIMALS) for v in vector]
+
+
+def _quantize_int8(vector):
+    """
+    Quantize an embedding to signed 8-bit integers with a per-vector scale
+    (value ~= q * scale). Returns (int8 array, scale).
+    """
+    peak = max(map(abs, vector), default=0.0)
+    scale = peak / 127.0 or 1.0
+    return array("b", [round(v / scale) for v in vector]), scale
+
+
+def _decode_int8(hex_bytes: str):
+    """
+    Decode an embedding_q8 bytea value as returned by PostgREST ("\\x..." hex).
+    """
+    return array("b", bytes.fromhex(hex_bytes[2:]))
+
+
+def _serialize_vector(vector) -> str:
+    """
+    Serialize an embedding for the embedding_json column in compact form.
+    """
+    return orjson.dumps(_quantize_vector(vector)).decode()
+
+
+def _embed_batch(client, texts: list):
+    """
+    Embed a batch of texts with a single Gemini request.
+    Returns a list of vectors aligned with texts; entries are None if embedding fails.
+    """
+    if not client or not texts:
+        return [None] * len(texts)
+    try:
+        response = _embed_content(client, texts)
+        vectors = [_pack_vector(e.values) for e in (response.embeddings or [])]
+        # output_dimensionality pins the dimension server-side, so checking the
+        # first vector is enough to catch a misconfigured model or dimension
+        if len(vectors) == len(texts) and len(vectors[0]) == EMBEDDING_DIM:
+            return vectors
+        logger.warning(
+            "Embedding batch returned %d vectors of %d dims, expected %d x %d",
+            len(vectors), len(vectors[0]) if vectors else 0, len(texts), EMBEDDING_DIM,
+        )
+    except Exception:
+        pass
+    return [None] * len(texts)
+
+
+async def _embed_texts(client, texts: list, batch_size: int = EMBED_BATCH_SIZE,
+                       max_concurrency: int = EMBED_MAX_CONCURRENCY):
+    """
+    Embed many texts using length-sorted micro-batches sent concurrently.
+    Sorting by length keeps similarly sized texts together; results are returned
+    in the original order. Blank texts get None without being sent.
+    """
+    vectors = [None] * len(texts)
+    order = sorted((i for i, t in enumerate(texts) if t.strip()), key=lambda i: len(texts[i]))
+    batches = [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def embed_one(indices):
+        async with semaphore:
+            batch_vectors = await asyncio.to_thread(_embed_batch, client, [texts[i] for i in indices])
+        for i, vector in zip(indices, batch_vectors):
+            vectors[i] = vector
+
+    await asyncio.gather(*(embed_one(indices) for indices in batches))
+    return vectors
+
+
+def _write_in_background(write):
+    """
+    Run a cache write-back without making the request wait for it.
+    """
+    # Keep a reference until done, or the task may be garbage-collected mid-write
+    task = asyncio.ensure_future(write)
+    _background_writes.add(task)
+    task.add_done_callback(_background_writes.discard)
+
+
+async def _embed_texts_cached(sb, client, texts: list, wait_for_write: bool = True):
+    """
+    Embed texts, reusing cached vectors for any text embedded before with the same
+    model (exactly, or up to case, punctuation and whitespace). Only cache misses
+    are sent to Gemini; new vectors are written back to the cache, in the background
+    if `wait_for_write` is False. Results are returned in the original order, with
+    None for blank texts.
+    """
+    vectors, misses = await asyncio.to_thread(embedding_cache.get_many, sb, EMBEDDING_MODEL, texts)
+    # A vector cached before EMBEDDING_DIM changed would be rejected by the RPC
+    stale = [i for i, v in enumerate(vectors) if v is not None and len(v) != EMBEDDING_DIM]
+    if stale:
+        for i in stale:
+            vectors[i] = None
+        misses = sorted(misses + stale)
+    if not misses:
+        return vectors
+
+    # Repeated chunks (running headers, footers, boilerplate) are embedded once
+    unique_texts = list(dict.fromkeys(texts[i] for i in misses))
+    fresh = dict(zip(unique_texts, await _embed_texts(client, unique_texts)))
+    for i in misses:
+        vectors[i] = fresh[texts[i]]
+    new_vectors = {text: vector for text, vector in fresh.items() if vector}
+    if new_vectors:
+        write = asyncio.to_thread(
+            embedding_cache.put_many, sb, EMBEDDING_MODEL, new_vectors, _serialize_vector
+        )
+        if wait_for_write:
+            await write
+        else:
+            _write_in_background(write)
+    return vectors
+
+
+def verify_embeddings_setup() -> bool:
+    """
+    Check that the Gemini client is configured and can embed a short probe text.
+    Returns True on success, False otherwise.
+    """
+    # One attempt: a probe must answer within the health timeout, not back off
+    return _embed_text(
+        _get_gemini_client(), "health check", attempts=1, timeout_ms=HEALTH_PROBE_TIMEOUT_MS,
+    ) is not None
+
+
+def warm_up() -> dict:
+    """
+    Prime the Gemini client, the embedding and generation endpoints and the pgvector
+    search RPC so the first user request does not pay their cold-start cost.
+    Returns the time spent on each step in milliseconds.
+    """
+    timings = {}
+    started = time.perf_counter()
+    client = _get_gemini_client()
+    timings["gemini_client"] = round((time.perf_counter() - started) * 1000)
+
+    if client and GENERATION_MODELS:
+        # count_tokens is free and exercises the generation model path and config
+        started = time.perf_counter()
+        try:
+            _generation_config()
+            client.models.count_tokens(model=GENERATION_MODELS[0], contents="warmup")
+        except Exception:
+            pass
+        timings["generation"] = round((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    # One attempt, so a Gemini outage or 429 cannot stall startup with retries
+    vector = _embed_text(client, "warmup", attempts=1)
+    timings["embedding"] = round((time.perf_counter() - started) * 1000)
+
+    if vector:
+        started = time.perf_counter()
+        try:
+            sb = get_supabase()
+        except RuntimeError:   # Supabase not configured
+            sb = None
+        if sb is not None:
+            _match_chunks_rpc(sb, vector)
+        timings["vector_search"] = round((time.perf_counter() - started) * 1000)
+    return timings
 
 
 def _try_multimodal_embed(client, image_bytes: bytes, page_text: str):
@@ -159,7 +629,7 @@ def _try_multimodal_embed(client, image_bytes: bytes, page_text: str):
             ],
         )
         if hasattr(response, "embeddings") and response.embeddings:
-            return response.embeddings[0].values
+            return _pack_vector(response.embeddings[0].values)
     except Exception:
         return None
     return None
@@ -172,119 +642,555 @@ def _caption_image_with_gemini(client, image_bytes: bytes):
     """
     if not client:
         return ""
-    mime_type = _safe_mime_type(image_bytes)
-
-    prompt = (
-        "You are helping index educational PDFs for retrieval. "
-        "Describe this image in concise, factual terms with learning-relevant details."
-    )
-
+    # Building the part can fail too (SDK import, unreadable image); that must cost
+    # this caption only, not the page being captioned
     try:
         from google.genai import types
-        response = client.models.generate_content(
-            model=GENERATION_MODEL,
-            contents=[
-                prompt,
-                types.Part.from_bytes(data=image_bytes, mime_type=mime_type),
-            ],
-        )
-        return (response.text or "").strip()
+        contents = [
+            CAPTION_PROMPT,
+            types.Part.from_bytes(data=image_bytes, mime_type=_safe_mime_type(image_bytes)),
+        ]
     except Exception:
+        return ""
+    for model in GENERATION_MODELS:
         try:
-            from google.genai import types
-            response = client.models.generate_content(
-                model=GENERATION_MODEL_FALLBACK,
-                contents=[
-                    prompt,
-                    types.Part.from_bytes(data=image_bytes, mime_type=mime_type),
-                ],
-            )
+            response = client.models.generate_content(model=model, contents=contents)
             return (response.text or "").strip()
         except Exception:
-            return ""
+            continue
+    return ""
 
 
-def _chunk_text(raw_text: str, chunk_size: int = 900, overlap: int = 120):
+def _chunk_fixed(raw_text: str, chunk_size: int, overlap: int):
     """
-    Split raw text into overlapping chunks for embedding and retrieval.
+    Split raw text into overlapping windows of up to chunk_size characters.
     Returns a list of text chunks.
     """
-    normalized = " ".join(raw_text.split())
-    if not normalized:
-        return []
+    return _chunk_windows(" ".join(raw_text.split()), chunk_size, overlap)
 
-    chunks = []
-    start_index = 0
+
+def _chunk_windows(normalized: str, chunk_size: int, overlap: int):
+    """
+    Split whitespace-normalized text into overlapping windows of up to chunk_size
+    characters. Each window ends at the last sentence end (or failing that, the last
+    space) within its final BOUNDARY_SNAP_CHARS characters, so chunks do not cut words.
+    Returns a list of text chunks.
+    """
     text_length = len(normalized)
-    while start_index < text_length:
-        end_index = min(start_index + chunk_size, text_length)
-        chunk = normalized[start_index:end_index].strip()
+    chunks = []
+    start = 0
+    while start < text_length:
+        end = start + chunk_size
+        if end < text_length:
+            # rfind scans in C; whitespace is normalized, so ". " marks a sentence end.
+            # It only touches the last BOUNDARY_SNAP_CHARS of each window, which
+            # measured ~4x faster than indexing every boundary up front with
+            # re.finditer and bisecting: building the index visits the whole text.
+            window_start = max(start + 1, end - BOUNDARY_SNAP_CHARS)
+            sentence_end = max(
+                normalized.rfind(". ", window_start, end),
+                normalized.rfind("! ", window_start, end),
+                normalized.rfind("? ", window_start, end),
+            )
+            if sentence_end != -1:
+                end = sentence_end + 1
+            else:
+                space = normalized.rfind(" ", window_start, end)
+                if space != -1:
+                    end = space
+        else:
+            end = text_length
+
+        chunk = normalized[start:end].strip()
         if chunk:
             chunks.append(chunk)
-        if end_index == text_length:
+        if end >= text_length:
             break
-        start_index = max(0, end_index - overlap)
+        # Start the overlap at a word boundary
+        start = max(end - overlap, start + 1)
+        space = normalized.find(" ", start, end)
+        if space != -1:
+            start = space + 1
     return chunks
 
 
-def _cosine_similarity(vector_a, vector_b):
+@lru_cache(maxsize=8)
+def _sentence_chunk_re(chunk_size: int):
+    """
+    Compile a pattern whose matches pack whole sentences into chunks of up to
+    chunk_size characters of whitespace-normalized text. Each match ends at the last
+    sentence end that fits, else at the last word boundary, else is cut at chunk_size,
+    so the regex engine does the packing in a single C-level pass.
+    """
+    return re.compile(
+        rf"\S(?:.{{0,{chunk_size - 2}}}[.!?](?= |$)"
+        rf"|.{{0,{chunk_size - 1}}}(?= |$)"
+        rf"|.{{0,{chunk_size - 2}}}.)"
+    )
+
+
+def _chunk_text(raw_text: str, chunk_size: int = CHUNK_SIZE_CHARS,
+                overlap: int = CHUNK_OVERLAP_CHARS, strategy: str = None):
+    """
+    Split raw text into chunks for embedding and retrieval using the given strategy
+    ("fixed", "paragraph" or "sentence", default CHUNK_STRATEGY). Paragraphs or sentences
+    are packed into chunks of up to chunk_size characters. A paragraph longer than that
+    falls back to fixed-size windows; a sentence longer than that is split at word
+    boundaries. Returns a list of text chunks.
+    """
+    strategy = strategy or CHUNK_STRATEGY
+    if strategy == "sentence":
+        return _sentence_chunk_re(chunk_size).findall(" ".join(raw_text.split()))
+    split_re = _CHUNK_SPLITTERS.get(strategy)
+    if split_re is None:
+        return _chunk_fixed(raw_text, chunk_size, overlap)
+
+    chunks = []
+    current = ""
+    for unit in split_re.split(raw_text):
+        unit = " ".join(unit.split())
+        if not unit:
+            continue
+        if len(unit) > chunk_size:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.extend(_chunk_windows(unit, chunk_size, overlap))
+        elif current and len(current) + 1 + len(unit) > chunk_size:
+            chunks.append(current)
+            current = unit
+        else:
+            current = f"{current} {unit}" if current else unit
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _estimate_tokens(text: str) -> int:
+    """
+    Estimate the Gemini token count of a text: about one token per CJK character
+    and one per CHARS_PER_TOKEN characters of other scripts.
+    """
+    wide = len(_WIDE_CHAR_RE.findall(text))
+    return wide + -(-(len(text) - wide) // CHARS_PER_TOKEN)
+
+
+def _result_token_count(chunk: dict) -> int:
+    """
+    Return the token count of a chunk as shown in search results: the count stored
+    at ingest, unless the content is cut to RESULT_CONTENT_CHARS or the chunk predates
+    the column, in which case it is estimated from the shown text.
+    """
+    content = chunk["content"]
+    if chunk.get("token_count") is not None and len(content) <= RESULT_CONTENT_CHARS:
+        return chunk["token_count"]
+    return _estimate_tokens(content[:RESULT_CONTENT_CHARS])
+
+
+def _simhash(text: str) -> int:
+    """
+    Return a 64-bit SimHash of the text's lowercased word 3-shingles. Texts that
+    differ in only a few words have hashes a small Hamming distance apart.
+    """
+    words = text.lower().split()
+    shingles = {" ".join(words[i:i + 3]) for i in range(max(len(words) - 2, 1))}
+    # Bit-strings transposed with zip() tally each bit position in C, rather than
+    # 64 Python-level shifts per shingle
+    bits = [
+        format(int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), "big"), "064b")
+        for s in shingles
+    ]
+    half = len(bits) / 2
+    return int("".join("1" if column.count("1") > half else "0" for column in zip(*bits)), 2)
+
+
+def _vector_norm(vector) -> float:
+    """
+    Return the Euclidean norm of a vector.
+    """
+    return math.sqrt(sum(map(mul, vector, vector)))
+
+
+def _cosine_similarity(vector_a, vector_b, norm_a: float = None):
     """
     Compute the cosine similarity between two vectors.
+    Pass norm_a to reuse a precomputed norm when scoring one vector against many.
     Returns a float between 0.0 and 1.0.
     """
     if not vector_a or not vector_b or len(vector_a) != len(vector_b):
         return 0.0
 
-    dot = sum(a * b for a, b in zip(vector_a, vector_b))
-    norm_a = math.sqrt(sum(a * a for a in vector_a))
-    norm_b = math.sqrt(sum(b * b for b in vector_b))
+    # map(mul) keeps the per-element work in C instead of a generator expression
+    dot = sum(map(mul, vector_a, vector_b))
+    if norm_a is None:
+        norm_a = _vector_norm(vector_a)
+    norm_b = _vector_norm(vector_b)
     if norm_a == 0 or norm_b == 0:
         return 0.0
     return dot / (norm_a * norm_b)
 
 
-def _generate_rag_answer(client, user_query: str, retrieved_results: list):
+def _match_rpc_query(sb, query_vector, top_k: int, query_embedding=None):
     """
-    Generate an answer to the user query using retrieved context and Gemini models.
-    Returns the generated answer as a string.
+    Build the pgvector match RPC call for a query vector. Pass `query_embedding`
+    if the caller already has the vector rounded with _quantize_vector.
     """
-    if not client or not retrieved_results:
-        return "Could not generate an AI answer. Please check that your Gemini API key is configured."
+    params = {
+        "query_embedding": query_embedding or _quantize_vector(query_vector),
+        "match_count": top_k,
+        "similarity_threshold": SIMILARITY_THRESHOLD,
+    }
+    fn = "match_rag_chunks"
+    if QUANTIZED_SEARCH:
+        fn = "match_rag_chunks_quantized"
+        params["oversample"] = QUANTIZED_OVERSAMPLE
+    return sb.rpc(fn, params)
+
+
+def _match_rpc_failed(exc: Exception):
+    """
+    Handle a failed match RPC. Only a missing function (PostgREST 404 / PGRST202,
+    i.e. the pgvector migration is not applied) disables the RPC for
+    MATCH_RPC_RETRY_SECONDS; other errors, such as a timeout, fall back for the
+    current request only.
+    """
+    global _match_rpc_disabled_until
+    message = str(exc)
+    if "PGRST202" in message or "PostgREST error 404" in message:
+        _match_rpc_disabled_until = time.monotonic() + MATCH_RPC_RETRY_SECONDS
+        logger.warning("Match RPC unavailable, using client-side ranking for %ds: %s",
+                       MATCH_RPC_RETRY_SECONDS, exc)
+    else:
+        logger.warning("Match RPC failed, using client-side ranking for this search: %s", exc)
 
-    context_lines = []
-    for idx, result in enumerate(retrieved_results[:5], 1):
-        source_name = result.get('source', 'Unknown')
-        page = result.get('page_number', 1)
-        context_lines.append(
-            f"[Source {idx}: {source_name}, Page {page}]\n{result['content']}"
-        )
 
-    prompt = (
-        "You are EduRag, an intelligent educational RAG (Retrieval-Augmented Generation) assistant.\n"
-        "Your job is to generate a clear, helpful, and well-structured answer based ONLY on the retrieved context below.\n"
-        "IMPORTANT RULES:\n"
-        "1. Synthesize the information into a coherent answer — do NOT just copy-paste chunks.\n"
-        "2. At the END of your answer, add a 'Sources:' section listing which sources you used "
-        "(e.g., 'Sources: Source 1 (filename.pdf, Page 3), Source 2 (filename.pdf, Page 7)').\n"
-        "3. If the context does not contain enough info, say so clearly.\n"
-        "4. Keep the answer educational, concise, and well-formatted.\n\n"
-        f"Student's Question: {user_query}\n\n"
+def _match_chunks_rpc(sb, query_vector, top_k: int = SEARCH_TOP_K):
+    """
+    Rank chunks in Postgres with the HNSW-indexed `match_rag_chunks` function
+    (or `match_rag_chunks_quantized` when RAG_QUANTIZED_SEARCH is enabled).
+    Returns a list of (similarity, chunk, modality) tuples, or None if the RPC is
+    unavailable (e.g. the pgvector migration has not been applied yet).
+    """
+    if time.monotonic() < _match_rpc_disabled_until:
+        return None
+    try:
+        rows = _match_rpc_query(sb, query_vector, top_k).execute().data or []
+    except Exception as exc:
+        _match_rpc_failed(exc)
+        return None
+    return [(row["similarity"], row, row.get("modality")) for row in rows]
+
+
+async def _match_chunks_rpc_async(sb, query_vector, top_k: int = SEARCH_TOP_K, query_embedding=None):
+    """
+    Same as _match_chunks_rpc, but the request is awaited on the event loop instead
+    of holding a worker thread for the round trip.
+    """
+    if time.monotonic() < _match_rpc_disabled_until:
+        return None
+    try:
+        rows = (await _match_rpc_query(sb, query_vector, top_k, query_embedding).aexecute()).data or []
+    except Exception as exc:
+        _match_rpc_failed(exc)
+        return None
+    return [(row["similarity"], row, row.get("modality")) for row in rows]
+
+
+def _rank_chunks_client_side(sb, query_vector, top_k: int = SEARCH_TOP_K):
+    """
+    Fallback ranking: fetch every stored embedding and score it in Python.
+    Returns (similarity, chunk, modality) tuples above the threshold, best first.
+    """
+    # int8 vectors are ~5x smaller to transfer than embedding_json; cosine similarity
+    # is scale-invariant, so they are scored directly. Rows stored before the
+    # quantized column existed are fetched as JSON.
+    emb_rows = sb.table("rag_embeddings").select("pdf_chunk_id, modality, embedding_q8").execute().data or []
+    if any(not r.get("embedding_q8") for r in emb_rows):
+        emb_rows = [r for r in emb_rows if r.get("embedding_q8")]
+        emb_rows += (
+            sb.table("rag_embeddings")
+            .select("pdf_chunk_id, modality, embedding_json")
+            .is_("embedding_q8", "null")
+            .execute()
+        ).data or []
+
+    # Batch-fetch all referenced chunks
+    chunk_ids = list({r["pdf_chunk_id"] for r in emb_rows if r.get("pdf_chunk_id")})
+    chunk_map = {}
+    if chunk_ids:
+        # Supabase .in_() has a limit; batch if needed
+        for i in range(0, len(chunk_ids), 200):
+            batch = chunk_ids[i:i+200]
+            c_resp = sb.table("pdf_chunks").select("id, content, source_file, page_number, token_count").in_("id", batch).execute()
+            for c in (c_resp.data or []):
+                chunk_map[c["id"]] = c
+
+    query_norm = _vector_norm(query_vector)
+    ranked = []
+    for emb in emb_rows:
+        try:
+            if emb.get("embedding_q8"):
+                chunk_vector = _decode_int8(emb["embedding_q8"])
+            else:
+                chunk_vector = orjson.loads(emb["embedding_json"])
+            similarity = _cosine_similarity(query_vector, chunk_vector, query_norm)
+        except Exception:
+            similarity = 0.0
+
+        # Only keep results above the threshold
+        if similarity >= SIMILARITY_THRESHOLD:
+            chunk = chunk_map.get(emb["pdf_chunk_id"])
+            if chunk:
+                ranked.append((similarity, chunk, emb.get("modality")))
+
+    return heapq.nlargest(top_k, ranked, key=lambda item: item[0])
+
+
+def _result_row(chunk: dict, relevance_score: float) -> dict:
+    """
+    Shape a matched chunk row into a search result.
+    """
+    return {
+        "id": chunk["id"],
+        "content": chunk["content"][:RESULT_CONTENT_CHARS],
+        "source": chunk["source_file"],
+        "relevance_score": relevance_score,
+        "page_number": chunk.get("page_number") or 1,
+        "token_count": _result_token_count(chunk),
+    }
+
+
+def _retrieve(sb, user_query: str, query_vector, ranked=None, top_k: int = SEARCH_TOP_K):
+    """
+    Find the top_k chunks that best match a query: semantic search when a query
+    vector is available, falling back to a keyword match (at most SEARCH_TOP_K rows)
+    if that finds nothing above threshold. `ranked` is the RPC result if the caller
+    already has it.
+    Returns (results, retrieval_mode, used_multimodal).
+    """
+    results = []
+    retrieval_mode = "keyword"
+    used_multimodal = False
+    if query_vector:
+        if ranked is None:
+            ranked = _match_chunks_rpc(sb, query_vector, top_k)
+        if ranked is None:
+            ranked = _rank_chunks_client_side(sb, query_vector, top_k)
+
+        top = ranked[:top_k]
+        results = [_result_row(chunk, round(float(similarity), 4)) for similarity, chunk, _ in top]
+        used_multimodal = any(modality == "multimodal" for _, _, modality in top)
+        if results:
+            retrieval_mode = "semantic"
+
+    # Keyword fallback — only if semantic found nothing above threshold
+    if not results:
+        kw_resp = sb.table("pdf_chunks").select("id, content, source_file, page_number, token_count").ilike("content", f"%{user_query}%").limit(min(top_k, SEARCH_TOP_K)).execute()
+        results = [_result_row(chunk, 0.90 - (idx * 0.05)) for idx, chunk in enumerate(kw_resp.data or [])]
+    return results, retrieval_mode, used_multimodal
+
+
+@lru_cache(maxsize=1)
+def _generation_config():
+    """
+    Return the answer generation config. The fixed instructions travel as the
+    system instruction, so every request shares the same cacheable prefix.
+    """
+    from google.genai import types
+    return types.GenerateContentConfig(system_instruction=ANSWER_SYSTEM_PROMPT)
+
+
+def _build_answer_prompt(user_query: str, retrieved_results: list) -> str:
+    """
+    Build the per-request part of the answer prompt: the retrieved context, then
+    the student's question.
+    """
+    # Take chunks best first until MAX_CONTEXT_TOKENS is reached; the first chunk is
+    # always kept, trimmed at a word boundary if it alone is over budget.
+    # Exact and near-duplicate chunks (e.g. the same paragraph in two versions of a
+    # handout) are skipped before the budget check, so an over-budget duplicate does
+    # not end the loop; the blake2b key is checked first as it is the cheaper test.
+    context = []
+    seen_hashes = set()
+    kept_simhashes = []
+    budget = MAX_CONTEXT_TOKENS
+    for result in retrieved_results:
+        content_key = hashlib.blake2b(result["content"].encode(), digest_size=16).digest()
+        if content_key in seen_hashes:
+            continue
+        simhash = _simhash(result["content"])
+        if any((simhash ^ kept).bit_count() <= SIMHASH_MAX_DISTANCE for kept in kept_simhashes):
+            continue
+        seen_hashes.add(content_key)
+        kept_simhashes.append(simhash)
+
+        tokens = result.get("token_count") or _estimate_tokens(result["content"])
+        if tokens > budget:
+            if not context:
+                cut = result["content"][:budget * CHARS_PER_TOKEN]
+                context.append({**result, "content": cut[:cut.rfind(" ")] if " " in cut else cut})
+            break
+        context.append(result)
+        budget -= tokens
+
+    # Context in a stable (file, page, chunk) order and the question last, so repeated
+    # retrievals of the same chunks produce a byte-identical prompt prefix
+    context = sorted(
+        context,
+        key=lambda r: (r.get('source', 'Unknown'), r.get('page_number', 1), str(r.get('id', ''))),
+    )
+    context_lines = [
+        f"[Source {idx}: {r.get('source', 'Unknown')}, Page {r.get('page_number', 1)}]\n{r['content']}"
+        for idx, r in enumerate(context, 1)
+    ]
+
+    return (
         "Retrieved Context:\n"
         + "\n\n".join(context_lines)
+        + f"\n\nStudent's Question: {user_query}"
     )
 
-    # Try primary model, then fallback
-    for model in [GENERATION_MODEL, GENERATION_MODEL_FALLBACK]:
-        try:
-            response = client.models.generate_content(model=model, contents=prompt)
-            text = (response.text or "").strip()
-            if text:
-                return text
-        except Exception as e:
-            print(f"Generation failed with {model}: {e}")
-            continue
 
-    # If both models fail, construct a basic answer from chunks
+def _answer_context(user_query: str, results: list, retrieval_mode: str) -> list:
+    """
+    Pick the retrieved chunks to send to Gemini. A short query whose best semantic
+    match is very strong ("what is osmosis") is answered from that chunk alone;
+    otherwise all results are used.
+    """
+    if (
+        retrieval_mode == "semantic"
+        and len(user_query.split()) <= FOCUSED_QUERY_MAX_WORDS
+        and results[0]["relevance_score"] >= FOCUSED_ANSWER_SIMILARITY
+    ):
+        return results[:1]
+    return results
+
+
+async def _stream_rag_answer(client, user_query: str, retrieved_results: list):
+    """
+    Stream an answer to the user query as text pieces arrive from Gemini. Transient
+    errors before the first piece are retried like _generate_text, then the fallback
+    model is tried; yields nothing if no model produced an answer. An error after
+    text has been yielded is re-raised, since the answer so far is incomplete.
+    """
+    if not client or not retrieved_results:
+        return
+    prompt = _build_answer_prompt(user_query, retrieved_results)
+
+    for model in GENERATION_MODELS:
+        for attempt in range(GENERATION_MAX_ATTEMPTS):
+            produced = False
+            try:
+                stream = await client.aio.models.generate_content_stream(
+                    model=model, contents=prompt, config=_generation_config(),
+                )
+                async for chunk in stream:
+                    if chunk.text:
+                        produced = True
+                        yield chunk.text
+                if produced:
+                    return
+                break
+            except Exception as e:
+                if produced:
+                    raise
+                delay = _retry_delay(e, attempt)
+                if delay is None or attempt + 1 == GENERATION_MAX_ATTEMPTS:
+                    logger.warning("Streaming generation failed with %s: %s", model, e)
+                    break
+                await asyncio.sleep(delay)
+
+
+async def _generate_text(client, contents, config=None):
+    """
+    Generate text with each of GENERATION_MODELS in turn, retrying transient errors
+    on the same model. Returns the first non-empty response text, or None.
+    """
+    for model in GENERATION_MODELS:
+        for attempt in range(GENERATION_MAX_ATTEMPTS):
+            try:
+                response = await client.aio.models.generate_content(
+                    model=model, contents=contents, config=config,
+                )
+                text = (response.text or "").strip()
+                if text:
+                    return text
+                break
+            except Exception as e:
+                delay = _retry_delay(e, attempt)
+                if delay is None or attempt + 1 == GENERATION_MAX_ATTEMPTS:
+                    logger.warning("Generation failed with %s: %s", model, e)
+                    break
+                await asyncio.sleep(delay)
+    return None
+
+
+async def _generate_rag_answer(client, user_query: str, retrieved_results: list):
+    """
+    Generate an answer to the user query using retrieved context and Gemini models.
+    Returns the generated answer, or None if no model produced one.
+    """
+    if not client or not retrieved_results:
+        return None
+    prompt = _build_answer_prompt(user_query, retrieved_results)
+    return await _generate_text(client, prompt, _generation_config())
+
+
+async def _generate_answers_batch(client, items: list):
+    """
+    Generate answers for many (query, results) pairs, at most
+    BULK_GENERATION_CONCURRENCY at a time. Returns answers aligned with items;
+    an entry is None where nothing was retrieved or no model produced an answer.
+    """
+    semaphore = asyncio.Semaphore(BULK_GENERATION_CONCURRENCY)
+
+    async def generate(user_query, results):
+        if not results or _low_relevance(results):
+            return None
+        async with semaphore:
+            return await _generate_rag_answer(client, user_query, results)
+
+    return await asyncio.gather(*(generate(q, results) for q, results in items))
+
+
+def _low_relevance(results: list) -> bool:
+    """
+    Return True if even the best retrieved chunk is below ANSWER_MIN_SIMILARITY.
+    """
+    return max(r["relevance_score"] for r in results) < ANSWER_MIN_SIMILARITY
+
+
+def _short_circuit_answer(user_query: str, results: list):
+    """
+    Return the canned reply for a query that retrieval cannot support (nothing found,
+    or nothing relevant enough), so no Gemini call is spent on it. Returns None if
+    the query should go to the model.
+    """
+    if results and not _low_relevance(results):
+        return None
+    _answer_stats["short_circuited"] += 1
+    return NO_RESULTS_ANSWER.format(query=user_query)
+
+
+def get_answer_stats() -> dict:
+    """
+    Return how this process has answered queries since startup, with the share of
+    answers that needed no Gemini call.
+    """
+    stats = {key: _answer_stats[key] for key in ("generated", "fallback", "cached", "short_circuited")}
+    total = sum(stats.values())
+    stats["total"] = total
+    stats["short_circuit_rate"] = round(stats["short_circuited"] / total, 4) if total else 0.0
+    return stats
+
+
+def _fallback_answer(client, user_query: str, retrieved_results: list):
+    """
+    Build the answer shown when Gemini is not configured or every model failed:
+    the top retrieved chunks with their sources.
+    """
+    if not client or not retrieved_results:
+        return "Could not generate an AI answer. Please check that your Gemini API key is configured."
     fallback_text = f"Here is what I found about \"{user_query}\":\n\n"
     for idx, result in enumerate(retrieved_results[:3], 1):
         fallback_text += f"{idx}. {result['content'][:300]}...\n\n"
@@ -293,7 +1199,296 @@ def _generate_rag_answer(client, user_query: str, retrieved_results: list):
     )
     return fallback_text
 
-@router.post("/search")
+
+_PIPELINE_DONE = object()
+
+
+def _prepare_page(client, page_info: dict):
+    """
+    Caption page images, build the composite page text and split it into chunks.
+    Returns a page job dict, or None if the page has no indexable content.
+    """
+    page_text = page_info["text"]
+    page_images = page_info["images"]
+
+    image_captions = []
+    image_embedding_payloads = []
+    multimodal_page = False
+
+    if page_images:
+        multimodal_page = True
+        # Caption and embed every image concurrently; map() keeps results in image order
+        images = page_images[:IMAGE_MAX_PER_PAGE]
+        pool = _get_image_pool()
+        captions = pool.map(_caption_image_with_gemini, repeat(client), images)
+        vectors = pool.map(_try_multimodal_embed, repeat(client), images, repeat(page_text))
+        for caption, multimodal_vector in zip(captions, vectors):
+            if caption:
+                image_captions.append(caption)
+            if multimodal_vector is not None:
+                image_embedding_payloads.append({
+                    "vector": multimodal_vector,
+                    "caption": caption or "Visual content from PDF image",
+                })
+
+    page_composite_text = page_text
+    if image_captions:
+        page_composite_text = (
+            f"{page_text}\n\nImage insights:\n" + "\n".join(f"- {c}" for c in image_captions)
+        )
+
+    if not page_composite_text or page_composite_text.isspace():
+        return None
+
+    return {
+        "page_number": page_info["page_number"],
+        "multimodal": multimodal_page,
+        "text_chunks": _chunk_text(page_composite_text),
+        "image_payloads": image_embedding_payloads,
+    }
+
+
+async def _insert_rows(sb, table: str, rows: list, returning: str = None):
+    """
+    Bulk-insert rows with one request per INSERT_BATCH_ROWS rows, sending up to
+    INSERT_MAX_CONCURRENCY groups at once. A failed group does not abort the others.
+    `returning` lists the columns to read back; without it nothing is echoed.
+    Returns (inserted rows, number of rows in failed groups).
+    """
+    groups = [rows[i:i + INSERT_BATCH_ROWS] for i in range(0, len(rows), INSERT_BATCH_ROWS)]
+    semaphore = asyncio.Semaphore(INSERT_MAX_CONCURRENCY)
+
+    async def insert_group(group):
+        async with semaphore:
+            if returning:
+                query = sb.table(table).insert(group).select(returning)
+            else:
+                query = sb.table(table).insert(group, returning="minimal")
+            return await asyncio.to_thread(query.execute)
+
+    results = await asyncio.gather(*(insert_group(group) for group in groups), return_exceptions=True)
+    inserted, failed = [], 0
+    for group, result in zip(groups, results):
+        if isinstance(result, Exception):
+            failed += len(group)
+            logger.warning("Insert of %d rows into %s failed: %s", len(group), table, result)
+        else:
+            inserted.extend(result.data or [])
+    logger.debug("Inserted %d rows into %s in %d batches", len(rows) - failed, table, len(groups))
+    return inserted, failed
+
+
+async def _store_pages(sb, pdf: dict, jobs: list):
+    """
+    Insert the text chunks, embeddings and image vectors of several pages in bulk.
+    Chunk indexes start at each job's first_chunk_index.
+    Returns (number of chunk rows, number of embedding rows) that failed to insert.
+    """
+    pdf_id = pdf["id"]
+    chunk_rows = []
+    pending_embeddings = []  # (chunk_index, modality, vector, page_number)
+
+    for job in jobs:
+        chunk_index = job["first_chunk_index"]
+        page_number = job["page_number"]
+        modality = "multimodal" if job["multimodal"] else "text"
+        for chunk_text, embedding_vector in zip(job["text_chunks"], job["embeddings"]):
+            chunk_rows.append({
+                "pdf_id": pdf_id,
+                "content": chunk_text,
+                "source_file": pdf["filename"],
+                "page_number": page_number,
+                "chunk_index": chunk_index,
+                "token_count": _estimate_tokens(chunk_text),
+            })
+            if embedding_vector:
+                pending_embeddings.append((chunk_index, modality, embedding_vector, page_number))
+            chunk_index += 1
+
+        # Image-specific multimodal vectors
+        for img_payload in job["image_payloads"]:
+            content = f"Image insight: {img_payload['caption']}"
+            chunk_rows.append({
+                "pdf_id": pdf_id,
+                "content": content,
+                "source_file": pdf["filename"],
+                "page_number": page_number,
+                "chunk_index": chunk_index,
+                "token_count": _estimate_tokens(content),
+            })
+            pending_embeddings.append((chunk_index, "multimodal", img_payload["vector"], page_number))
+            chunk_index += 1
+
+    inserted, failed_chunks = await _insert_rows(sb, "pdf_chunks", chunk_rows, returning="id, chunk_index")
+    chunk_ids = {row["chunk_index"]: row["id"] for row in inserted}
+
+    # Embeddings of chunks whose insert failed have no row to point at
+    embedding_rows = []
+    for index, modality, vector, page_number in pending_embeddings:
+        if index not in chunk_ids:
+            continue
+        quantized, scale = _quantize_int8(vector)
+        embedding_rows.append({
+            "pdf_id": pdf_id,
+            "pdf_chunk_id": chunk_ids[index],
+            "modality": modality,
+            "embedding_json": _serialize_vector(vector),
+            "embedding_q8": "\\x" + quantized.tobytes().hex(),
+            "embedding_scale": scale,
+            "page_number": page_number,
+        })
+    _, failed_embeddings = await _insert_rows(sb, "rag_embeddings", embedding_rows)
+    return failed_chunks, failed_embeddings
+
+
+async def _run_index_pipeline(sb, client, pdf: dict, pages):
+    """
+    Index pages from a page iterator as a pipeline: extract -> prepare (captions +
+    chunking) -> embed -> store.
+    Stages run concurrently and are linked by bounded queues, so embedding one page
+    overlaps with chunking the next and storing the previous one; the embed and store
+    stages each run several workers. Chunk indexes are assigned in page order by the
+    prepare stage, so worker interleaving does not affect them.
+    Returns (number of chunks stored, number of chunks that failed to store,
+    number of embeddings that failed to store).
+    """
+    page_queue = asyncio.Queue(maxsize=INDEX_QUEUE_SIZE)
+    embed_queue = asyncio.Queue(maxsize=INDEX_QUEUE_SIZE)
+    store_queue = asyncio.Queue(maxsize=INDEX_QUEUE_SIZE)
+    chunks_created = 0
+    failed_chunks = failed_embeddings = 0
+    embed_workers_left = INDEX_EMBED_WORKERS
+
+    async def produce_pages():
+        # Pull pages from the (blocking) extractor one at a time, off the event loop
+        while (page_info := await asyncio.to_thread(next, pages, _PIPELINE_DONE)) is not _PIPELINE_DONE:
+            await page_queue.put(page_info)
+        await page_queue.put(_PIPELINE_DONE)
+
+    async def prepare_pages():
+        nonlocal chunks_created
+        while (page_info := await page_queue.get()) is not _PIPELINE_DONE:
+            job = await asyncio.to_thread(_prepare_page, client, page_info)
+            if job is not None:
+                job["first_chunk_index"] = chunks_created
+                chunks_created += len(job["text_chunks"]) + len(job["image_payloads"])
+                await embed_queue.put(job)
+        for _ in range(INDEX_EMBED_WORKERS):
+            await embed_queue.put(_PIPELINE_DONE)
+
+    async def embed_chunks():
+        nonlocal embed_workers_left
+        while (job := await embed_queue.get()) is not _PIPELINE_DONE:
+            job["embeddings"] = await _embed_texts_cached(sb, client, job["text_chunks"])
+            await store_queue.put(job)
+        embed_workers_left -= 1
+        if embed_workers_left == 0:
+            for _ in range(INDEX_STORE_WORKERS):
+                await store_queue.put(_PIPELINE_DONE)
+
+    async def store_chunks():
+        # Buffer pages until a full insert batch is ready, then write them in bulk
+        async def flush(jobs):
+            nonlocal failed_chunks, failed_embeddings
+            chunks, embeddings = await _store_pages(sb, pdf, jobs)
+            failed_chunks += chunks
+            failed_embeddings += embeddings
+
+        pending, pending_rows = [], 0
+        while (job := await store_queue.get()) is not _PIPELINE_DONE:
+            pending.append(job)
+            pending_rows += len(job["text_chunks"]) + len(job["image_payloads"])
+            if pending_rows >= INSERT_BATCH_ROWS:
+                await flush(pending)
+                pending, pending_rows = [], 0
+        if pending:
+            await flush(pending)
+
+    try:
+        async with asyncio.TaskGroup() as tg:
+            tg.create_task(produce_pages())
+            tg.create_task(prepare_pages())
+            for _ in range(INDEX_EMBED_WORKERS):
+                tg.create_task(embed_chunks())
+            for _ in range(INDEX_STORE_WORKERS):
+                tg.create_task(store_chunks())
+    except ExceptionGroup as eg:
+        raise eg.exceptions[0]
+
+    return chunks_created - failed_chunks, failed_chunks, failed_embeddings
+
+
+def _log_search(sb, current_user: dict, user_query: str, language: str,
+                results_count: int, response_time_ms: int):
+    """
+    Record a search in search_history. Failures are ignored.
+    """
+    try:
+        sb.table("search_history").insert({
+            "user_id": current_user.get("id"),
+            "query": user_query,
+            "language": language,
+            "results_count": results_count,
+            "response_time_ms": response_time_ms,
+        }, returning="minimal").execute()
+    except Exception:
+        pass
+
+
+def _sse_event(event: str, data) -> bytes:
+    """
+    Encode one server-sent event with a JSON payload.
+    """
+    return b"event: " + event.encode() + b"\ndata: " + orjson.dumps(data) + b"\n\n"
+
+
+def _search_top_k(requested) -> int:
+    """
+    Return the number of chunks to retrieve for a caller-supplied top_k: the
+    default when unset, otherwise clamped to 0..SEARCH_MAX_TOP_K.
+    """
+    if requested is None:
+        return SEARCH_TOP_K
+    return max(0, min(requested, SEARCH_MAX_TOP_K))
+
+
+async def _retrieve_async(sb, user_query: str, query_vector, top_k: int = SEARCH_TOP_K,
+                          query_embedding=None):
+    """
+    Run _retrieve with the pgvector RPC awaited on the event loop. Only the
+    fallbacks (client-side ranking, keyword match) still run in a worker thread.
+    `query_embedding` is the rounded vector, if the caller already has it.
+    """
+    ranked = (
+        await _match_chunks_rpc_async(sb, query_vector, top_k, query_embedding) if query_vector else None
+    )
+    if ranked is None and query_vector:
+        # RPC failed or is disabled: rank client-side rather than calling it again
+        ranked = await asyncio.to_thread(_rank_chunks_client_side, sb, query_vector, top_k)
+    if ranked:
+        return _retrieve(sb, user_query, query_vector, ranked, top_k)
+    return await asyncio.to_thread(_retrieve, sb, user_query, query_vector, ranked, top_k)
+
+
+async def _lookup_and_retrieve(sb, user_query: str, query_vector, query_embedding, top_k: int):
+    """
+    Look up the answer cache and retrieve chunks concurrently, since both need only
+    the query embedding; on a cache hit the retrieval result is simply unused.
+    `query_embedding` is `query_vector` rounded once for both requests.
+    Cached answers were built from SEARCH_TOP_K chunks, so other sizes skip the cache.
+    Returns (cached (answer, results) or None, (results, retrieval_mode, used_multimodal)).
+    """
+    retrieval = _retrieve_async(sb, user_query, query_vector, top_k, query_embedding)
+    if not query_embedding or top_k != SEARCH_TOP_K:
+        return None, await retrieval
+    return await asyncio.gather(
+        asyncio.to_thread(answer_cache.lookup, sb, user_query, query_embedding), retrieval
+    )
+
+
+# The payload is built from plain JSON types, so it is returned as a Response directly;
+# RAGResponse only documents the schema and skips per-request validation/encoding.
+@router.post("/search", responses={200: {"model": RAGResponse}})
 async def search_documents(
     query: RAGQuery,
     current_user: dict = Depends(get_current_user),
@@ -302,104 +1497,226 @@ async def search_documents(
     Search documents using Retrieval-Augmented Generation (RAG) from Supabase.
     Returns relevant results and a generated answer.
     """
+    try:
+        user_query = validate_query(query.query)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+    top_k = _search_top_k(query.top_k)
+    if top_k == 0:
+        return ORJSONResponse({
+            "query": user_query, "results": [], "total_results": 0, "response_time_ms": 0,
+            "retrieval_mode": "none", "used_multimodal": False, "generated_answer": None,
+        })
+
     start_time = time.time()
     gemini_client = _get_gemini_client()
-    retrieval_mode = "keyword"
     used_multimodal = False
 
     try:
         sb = get_supabase()
-        results = []
-        query_vector = _embed_text(gemini_client, query.query)
-
-        # Minimum cosine similarity threshold — below this, results are noise
-        SIMILARITY_THRESHOLD = 0.65
-
-        if query_vector:
-            # Fetch all embeddings with their chunk content via join-like approach
-            emb_rows = sb.table("rag_embeddings").select("id, pdf_chunk_id, modality, embedding_json").execute().data or []
-
-            # Batch-fetch all referenced chunks
-            chunk_ids = list({r["pdf_chunk_id"] for r in emb_rows if r.get("pdf_chunk_id")})
-            chunk_map = {}
-            if chunk_ids:
-                # Supabase .in_() has a limit; batch if needed
-                for i in range(0, len(chunk_ids), 200):
-                    batch = chunk_ids[i:i+200]
-                    c_resp = sb.table("pdf_chunks").select("id, content, source_file, page_number").in_("id", batch).execute()
-                    for c in (c_resp.data or []):
-                        chunk_map[c["id"]] = c
-
-            ranked = []
-            for emb in emb_rows:
-                try:
-                    chunk_vector = json.loads(emb["embedding_json"])
-                    similarity = _cosine_similarity(query_vector, chunk_vector)
-                except Exception:
-                    similarity = 0.0
-
-                # Only keep results above the threshold
-                if similarity >= SIMILARITY_THRESHOLD:
-                    if emb.get("modality") == "multimodal":
-                        used_multimodal = True
-                    chunk = chunk_map.get(emb["pdf_chunk_id"])
-                    if chunk:
-                        ranked.append((similarity, chunk))
-
-            ranked.sort(key=lambda item: item[0], reverse=True)
-            for similarity, chunk in ranked[:5]:
-                results.append({
-                    "id": chunk["id"],
-                    "content": chunk["content"][:700],
-                    "source": chunk["source_file"],
-                    "relevance_score": round(float(similarity), 4),
-                    "page_number": chunk.get("page_number") or 1,
-                })
-            if results:
-                retrieval_mode = "semantic"
-
-        # Keyword fallback — only if semantic found nothing above threshold
-        if not results:
-            kw_resp = sb.table("pdf_chunks").select("id, content, source_file, page_number").ilike("content", f"%{query.query}%").limit(5).execute()
-            for idx, chunk in enumerate(kw_resp.data or []):
-                results.append({
-                    "id": chunk["id"],
-                    "content": chunk["content"][:700],
-                    "source": chunk["source_file"],
-                    "relevance_score": 0.90 - (idx * 0.05),
-                    "page_number": chunk.get("page_number") or 1,
-                })
-
-        if not results:
-            generated_answer = f"No relevant results found for \"{query.query}\". The indexed PDFs may not contain information on this topic. Try a different query or ask your teacher to upload relevant course materials."
+        # A repeat of a recent question is answered from memory without embedding it
+        cached = answer_cache.get_recent(user_query) if top_k == SEARCH_TOP_K else None
+        if not cached:
+            (query_vector,) = await _embed_texts_cached(
+                sb, gemini_client, [user_query], wait_for_write=False
+            )
+            query_embedding = _quantize_vector(query_vector) if query_vector else None
+            cached, (results, retrieval_mode, used_multimodal) = await _lookup_and_retrieve(
+                sb, user_query, query_vector, query_embedding, top_k
+            )
+        if cached:
+            generated_answer, results = cached
+            retrieval_mode = "cached"
+            used_multimodal = False
+            _answer_stats["cached"] += 1
         else:
-            generated_answer = _generate_rag_answer(gemini_client, query.query, results)
+            generated_answer = _short_circuit_answer(user_query, results)
+        if not generated_answer:
+            generated_answer = await _generate_rag_answer(
+                gemini_client, user_query, _answer_context(user_query, results, retrieval_mode)
+            )
+            _answer_stats["generated" if generated_answer else "fallback"] += 1
+            if not generated_answer:
+                generated_answer = _fallback_answer(gemini_client, user_query, results)
+            elif retrieval_mode == "semantic" and top_k == SEARCH_TOP_K:
+                _write_in_background(asyncio.to_thread(
+                    answer_cache.store, sb, user_query, query_embedding, generated_answer, results
+                ))
         response_time = int((time.time() - start_time) * 1000)
 
-        # Log search history
-        try:
-            sb.table("search_history").insert({
-                "user_id": current_user.get("id"),
-                "query": query.query,
-                "language": query.language,
-                "results_count": len(results),
-                "response_time_ms": response_time,
-            }).execute()
-        except Exception:
-            pass
+        await asyncio.to_thread(
+            _log_search, sb, current_user, user_query, query.language, len(results), response_time
+        )
 
-        return {
-            "query": query.query,
+        return ORJSONResponse({
+            "query": user_query,
             "results": results,
             "total_results": len(results),
             "response_time_ms": response_time,
             "retrieval_mode": retrieval_mode,
             "used_multimodal": used_multimodal,
             "generated_answer": generated_answer,
-        }
+        })
+
+    except Exception:
+        # Re-raised as is, so the original traceback is kept; the app-wide handler
+        # answers 500 without echoing internal error text to the client
+        logger.exception("Search failed for query %r", user_query[:100])
+        raise
+
+
+@router.post("/search/stream")
+async def search_documents_stream(
+    query: RAGQuery,
+    current_user: dict = Depends(get_current_user),
+):
+    """
+    Search like /search, but stream the answer as server-sent events: a "results"
+    event with the retrieved chunks, "token" events carrying answer text as Gemini
+    produces it, an "error" event (with a fallback answer) if generation breaks off
+    mid-answer, and a final "done" event.
+    """
+    try:
+        user_query = validate_query(query.query)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+    top_k = _search_top_k(query.top_k)
+    start_time = time.time()
+    gemini_client = _get_gemini_client()
+    sb = get_supabase()
+    cached = answer_cache.get_recent(user_query) if top_k == SEARCH_TOP_K else None
+    if top_k == 0:
+        results, retrieval_mode, used_multimodal = [], "none", False
+    elif not cached:
+        (query_vector,) = await _embed_texts_cached(
+            sb, gemini_client, [user_query], wait_for_write=False
+        )
+        query_embedding = _quantize_vector(query_vector) if query_vector else None
+        cached, (results, retrieval_mode, used_multimodal) = await _lookup_and_retrieve(
+            sb, user_query, query_vector, query_embedding, top_k
+        )
+    if cached:
+        cached_answer, results = cached
+        retrieval_mode = "cached"
+        used_multimodal = False
+
+    async def events():
+        yield _sse_event("results", {
+            "query": user_query,
+            "results": results,
+            "total_results": len(results),
+            "retrieval_mode": retrieval_mode,
+            "used_multimodal": used_multimodal,
+        })
+        if top_k == 0:
+            yield _sse_event("done", {"response_time_ms": 0})
+            return
+        canned = None if cached else _short_circuit_answer(user_query, results)
+        if cached:
+            _answer_stats["cached"] += 1
+            yield _sse_event("token", cached_answer)
+        elif canned:
+            yield _sse_event("token", canned)
+        else:
+            pieces = []
+            interrupted = False
+            context = _answer_context(user_query, results, retrieval_mode)
+            try:
+                async for piece in _stream_rag_answer(gemini_client, user_query, context):
+                    pieces.append(piece)
+                    yield _sse_event("token", piece)
+            except Exception as e:
+                logger.warning("Answer stream interrupted: %s", e)
+                interrupted = True
+            answer = "".join(pieces).strip()
+            # A truncated answer is neither counted as generated nor cached
+            _answer_stats["generated" if answer and not interrupted else "fallback"] += 1
+            if interrupted:
+                yield _sse_event("error", {
+                    "detail": "The answer was interrupted",
+                    "fallback_answer": _fallback_answer(gemini_client, user_query, results),
+                })
+            elif not answer:
+                yield _sse_event("token", _fallback_answer(gemini_client, user_query, results))
+            elif retrieval_mode == "semantic" and top_k == SEARCH_TOP_K:
+                _write_in_background(asyncio.to_thread(
+                    answer_cache.store, sb, user_query, query_embedding, answer, results
+                ))
+        response_time = int((time.time() - start_time) * 1000)
+        await asyncio.to_thread(
+            _log_search, sb, current_user, user_query, query.language, len(results), response_time
+        )
+        yield _sse_event("done", {"response_time_ms": response_time})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.post("/bulk-qa")
+async def bulk_qa(
+    request: BulkQARequest,
+    current_user: dict = Depends(get_current_user),
+):
+    """
+    Answer a list of questions in one call, e.g. to spot-check answer quality after
+    re-indexing. All questions are embedded in one request, searched concurrently
+    and answered concurrently. Only teachers and admins can perform this action.
+    """
+    if current_user.get("role") not in STAFF_ROLES:
+        raise HTTPException(status_code=403, detail="Only teachers and admins can run bulk QA")
+    if len(request.queries) > BULK_QA_MAX_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {BULK_QA_MAX_QUERIES} queries per request")
+    try:
+        queries = [validate_query(q) for q in request.queries]
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+    start_time = time.time()
+    gemini_client = _get_gemini_client()
+    sb = get_supabase()
+
+    query_vectors = await _embed_texts_cached(sb, gemini_client, queries, wait_for_write=False)
+    semaphore = asyncio.Semaphore(BULK_RETRIEVAL_CONCURRENCY)
+
+    async def retrieve_one(user_query, query_vector):
+        async with semaphore:
+            results, retrieval_mode, _ = await _retrieve_async(sb, user_query, query_vector)
+        return user_query, results, retrieval_mode
+
+    retrieved = await asyncio.gather(*(retrieve_one(q, v) for q, v in zip(queries, query_vectors)))
+
+    answers = await _generate_answers_batch(
+        gemini_client,
+        [(q, _answer_context(q, results, mode)) for q, results, mode in retrieved],
+    )
+
+    items = []
+    for (user_query, results, retrieval_mode), answer in zip(retrieved, answers):
+        if answer:
+            _answer_stats["generated"] += 1
+        else:
+            answer = _short_circuit_answer(user_query, results)
+        if not answer:
+            _answer_stats["fallback"] += 1
+            answer = _fallback_answer(gemini_client, user_query, results)
+        items.append({
+            "query": user_query,
+            "results": results,
+            "retrieval_mode": retrieval_mode,
+            "generated_answer": answer,
+        })
+
+    return ORJSONResponse({
+        "answers": items,
+        "total": len(items),
+        "response_time_ms": int((time.time() - start_time) * 1000),
+    })
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/upload-pdf")
 async def upload_pdf(
@@ -410,25 +1727,39 @@ async def upload_pdf(
     Upload a PDF file to Supabase Storage (Teacher/Admin only).
     Returns the uploaded PDF's metadata.
     """
-    if current_user.get("role") not in ["teacher", "admin"]:
+    if current_user.get("role") not in STAFF_ROLES:
         raise HTTPException(status_code=403, detail="Only teachers and admins can upload PDFs")
 
-    if not file.filename.lower().endswith('.pdf'):
-        raise HTTPException(status_code=400, detail="Only PDF files are allowed")
+    try:
+        validate_filename(file.filename)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+    if file.size is not None and file.size > MAX_PDF_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="PDF exceeds the maximum upload size")
 
     try:
         sb = get_supabase()
         _ensure_storage_bucket(sb)
 
-        file_bytes = await file.read()
-        # Use a unique path to avoid collisions
-        storage_path = f"{int(time.time())}_{file.filename}"
-
-        sb.storage.from_(STORAGE_BUCKET).upload(
-            path=storage_path,
-            file=file_bytes,
-            file_options={"content-type": "application/pdf"},
-        )
+        # Stream the upload into a spooled temp file instead of one big bytes buffer
+        with tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MAX_BYTES) as spool:
+            total_bytes = 0
+            while chunk := await file.read(UPLOAD_READ_CHUNK_BYTES):
+                total_bytes += len(chunk)
+                if total_bytes > MAX_PDF_UPLOAD_BYTES:
+                    raise HTTPException(status_code=413, detail="PDF exceeds the maximum upload size")
+                spool.write(chunk)
+            spool.seek(0)
+
+            # Use a unique path to avoid collisions
+            storage_path = f"{int(time.time())}_{file.filename}"
+
+            sb.storage.from_(STORAGE_BUCKET).upload(
+                path=storage_path,
+                file=spool,
+                file_options={"content-type": "application/pdf"},
+            )
 
         resp = sb.table("pdfs").insert({
             "filename": file.filename,
@@ -507,7 +1838,6 @@ async def get_trending_topics(
     try:
         sb = get_supabase()
         rows = sb.table("search_history").select("query").execute().data or []
-        from collections import Counter
         counts = Counter(r["query"] for r in rows if r.get("query"))
         return [
             {"topic": q, "count": c, "difficulty": "High" if c > 40 else "Medium" if c > 20 else "Low"}
@@ -517,6 +1847,20 @@ async def get_trending_topics(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/answer-stats")
+async def answer_stats(
+    current_user: dict = Depends(get_current_user),
+):
+    """
+    Report how answers were produced since this instance started (generated,
+    fallback, cached, short-circuited without a Gemini call).
+    Only teachers and admins can view this.
+    """
+    if current_user.get("role") not in STAFF_ROLES:
+        raise HTTPException(status_code=403, detail="Only teachers and admins can view answer stats")
+    return get_answer_stats()
+
+
 @router.delete("/pdfs/{pdf_id}")
 async def delete_pdf(
     pdf_id: int,
@@ -525,7 +1869,7 @@ async def delete_pdf(
     """
     Delete a PDF from Supabase Storage and database (Teacher/Admin only).
     """
-    if current_user.get("role") not in ["teacher", "admin"]:
+    if current_user.get("role") not in STAFF_ROLES:
         raise HTTPException(status_code=403, detail="Only teachers and admins can delete PDFs")
 
     sb = get_supabase()
@@ -545,6 +1889,7 @@ async def delete_pdf(
     sb.table("rag_embeddings").delete().eq("pdf_id", pdf_id).execute()
     sb.table("pdf_chunks").delete().eq("pdf_id", pdf_id).execute()
     sb.table("pdfs").delete().eq("id", pdf_id).execute()
+    answer_cache.invalidate(sb, pdf["filename"])
 
     return {"message": "PDF deleted successfully"}
 
@@ -558,7 +1903,7 @@ async def index_pdf(
     Index a PDF: download from Supabase Storage, extract text/images, create chunks and embeddings.
     Only teachers and admins can perform this action.
     """
-    if current_user.get("role") not in ["teacher", "admin"]:
+    if current_user.get("role") not in STAFF_ROLES:
         raise HTTPException(status_code=403, detail="Only teachers and admins can index PDFs")
 
     sb = get_supabase()
@@ -571,101 +1916,44 @@ async def index_pdf(
     try:
         gemini_client = _get_gemini_client()
 
-        # Download PDF from Supabase Storage to a temp file
-        tmp_path = _download_pdf_from_storage(sb, pdf["storage_path"])
-
-        # Delete existing chunks/embeddings for this PDF
-        sb.table("rag_embeddings").delete().eq("pdf_id", pdf_id).execute()
-        sb.table("pdf_chunks").delete().eq("pdf_id", pdf_id).execute()
-
-        pages, total_pages = _extract_text_and_images_from_pdf(tmp_path)
-        chunks_created = 0
-
-        for page_info in pages:
-            page_number = page_info["page_number"]
-            page_text = page_info["text"]
-            page_images = page_info["images"]
-
-            image_captions = []
-            image_embedding_payloads = []
-            multimodal_page = False
-
-            if page_images:
-                multimodal_page = True
-                for image_bytes in page_images[:4]:
-                    caption = _caption_image_with_gemini(gemini_client, image_bytes)
-                    if caption:
-                        image_captions.append(caption)
-                    multimodal_vector = _try_multimodal_embed(gemini_client, image_bytes, page_text)
-                    if multimodal_vector is not None:
-                        image_embedding_payloads.append({
-                            "vector": multimodal_vector,
-                            "caption": caption or "Visual content from PDF image",
-                        })
-
-            page_composite_text = page_text
-            if image_captions:
-                page_composite_text = (
-                    f"{page_text}\n\nImage insights:\n" + "\n".join(f"- {c}" for c in image_captions)
-                ).strip()
-
-            if not page_composite_text.strip():
-                continue
-
-            text_chunks = _chunk_text(page_composite_text)
-            for chunk_text in text_chunks:
-                chunk_resp = sb.table("pdf_chunks").insert({
-                    "pdf_id": pdf_id,
-                    "content": chunk_text,
-                    "source_file": pdf["filename"],
-                    "page_number": page_number,
-                    "chunk_index": chunks_created,
-                }).execute()
-                new_chunk = chunk_resp.data[0]
-
-                embedding_vector = _embed_text(gemini_client, chunk_text)
-                if embedding_vector:
-                    sb.table("rag_embeddings").insert({
-                        "pdf_id": pdf_id,
-                        "pdf_chunk_id": new_chunk["id"],
-                        "modality": "multimodal" if multimodal_page else "text",
-                        "embedding_json": json.dumps(embedding_vector),
-                        "page_number": page_number,
-                    }).execute()
-
-                chunks_created += 1
-
-            # Image-specific multimodal vectors
-            for img_payload in image_embedding_payloads:
-                img_chunk_resp = sb.table("pdf_chunks").insert({
-                    "pdf_id": pdf_id,
-                    "content": f"Image insight: {img_payload['caption']}",
-                    "source_file": pdf["filename"],
-                    "page_number": page_number,
-                    "chunk_index": chunks_created,
-                }).execute()
-                img_chunk = img_chunk_resp.data[0]
-
-                sb.table("rag_embeddings").insert({
-                    "pdf_id": pdf_id,
-                    "pdf_chunk_id": img_chunk["id"],
-                    "modality": "multimodal",
-                    "embedding_json": json.dumps(img_payload["vector"]),
-                    "page_number": page_number,
-                }).execute()
-                chunks_created += 1
+        # Bound concurrent ingests so a burst of uploads cannot multiply the
+        # in-flight embedding calls and insert batches without limit
+        async with INGEST_SEMAPHORE:
+            # Download PDF from Supabase Storage to a temp file
+            tmp_path = await asyncio.to_thread(_download_pdf_from_storage, sb, pdf["storage_path"])
+
+            # Delete existing chunks/embeddings for this PDF
+            await asyncio.to_thread(
+                lambda: sb.table("rag_embeddings").delete().eq("pdf_id", pdf_id).execute()
+            )
+            await asyncio.to_thread(
+                lambda: sb.table("pdf_chunks").delete().eq("pdf_id", pdf_id).execute()
+            )
+            await asyncio.to_thread(answer_cache.invalidate, sb, pdf["filename"])
+
+            # Pages stream into the pipeline as they are parsed; large files fan out
+            # over the process pool
+            total_pages, pages = await asyncio.to_thread(_open_pdf_pages, tmp_path)
+            chunks_stored, failed_chunks, failed_embeddings = await _run_index_pipeline(
+                sb, gemini_client, pdf, pages
+            )
 
         # Update PDF record
-        sb.table("pdfs").update({
+        await asyncio.to_thread(lambda: sb.table("pdfs").update({
             "status": "indexed",
             "total_pages": total_pages,
-            "total_chunks": chunks_created,
-        }).eq("id", pdf_id).execute()
+            "total_chunks": chunks_stored,
+        }).eq("id", pdf_id).execute())
 
+        message = f"PDF indexed successfully: {chunks_stored} chunks created from {total_pages} pages"
+        if failed_chunks or failed_embeddings:
+            message += f" ({failed_chunks} chunks and {failed_embeddings} embeddings failed to store)"
         return {
-            "message": f"PDF indexed successfully: {chunks_created} chunks created from {total_pages} pages",
+            "message": message,
             "total_pages": total_pages,
-            "total_chunks": chunks_created,
+            "total_chunks": chunks_stored,
+            "failed_chunks": failed_chunks,
+            "failed_embeddings": failed_embeddings,
         }
 
     except Exception as e:
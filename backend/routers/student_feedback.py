@@ -10,7 +10,7 @@ from pydantic import BaseModel
 from typing import Optional
 
 from database import get_supabase
-from routers.auth import get_current_user
+from routers.auth import STAFF_ROLES, get_current_user
 
 router = APIRouter()
 
@@ -48,7 +48,7 @@ async def get_student_feedback(
     current_user: dict = Depends(get_current_user),
 ):
     """Admins and teachers can view all student feedback."""
-    if current_user.get("role") not in ("admin", "teacher"):
+    if current_user.get("role") not in STAFF_ROLES:
         raise HTTPException(status_code=403, detail="Only admins and teachers can view student feedback")
     try:
         sb = get_supabase()
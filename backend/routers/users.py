@@ -10,7 +10,7 @@ from typing import Optional
 
 from models import UserUpdate
 from database import get_supabase
-from routers.auth import get_current_user
+from routers.auth import STAFF_ROLES, USER_ROLES, get_current_user
 
 router = APIRouter()
 
@@ -25,7 +25,7 @@ async def get_all_users(
     status: Optional[str] = None,
     current_user: dict = Depends(get_current_user),
 ):
-    if current_user.get("role") not in ["admin", "teacher"]:
+    if current_user.get("role") not in STAFF_ROLES:
         raise HTTPException(status_code=403, detail="Insufficient permissions")
     try:
         sb = get_supabase()
@@ -147,7 +147,7 @@ async def change_user_role(user_id: int, role_data: dict, current_user: dict = D
     if current_user.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Only admins can change roles")
     new_role = role_data.get("role")
-    if new_role not in ["student", "teacher", "admin"]:
+    if new_role not in USER_ROLES:
         raise HTTPException(status_code=400, detail="Invalid role")
     try:
         sb = get_supabase()
@@ -18,16 +18,70 @@ Usage:
 """
 
 import httpx
+import importlib.util
 import json
+import orjson
 import re
 from urllib.parse import quote as urlquote
 
 _TIMEOUT = 30.0
+_UPLOAD_CHUNK_BYTES = 1 << 20
+# Idle connections are kept for a minute so requests a few seconds apart reuse the TLS session
+_POOL_LIMITS = httpx.Limits(max_keepalive_connections=32, max_connections=64, keepalive_expiry=60.0)
+# HTTP/2 multiplexes concurrent PostgREST calls over one connection; it needs the
+# optional ``h2`` package (``pip install httpx[http2]``), else HTTP/1.1 is used
+_HTTP2 = importlib.util.find_spec("h2") is not None
+
+_http_client = None  # shared keep-alive client for PostgREST calls
+_async_http_client = None  # same, for calls awaited on the event loop
+
+
+def _iter_file(fileobj, chunk_size: int = _UPLOAD_CHUNK_BYTES):
+    """Yield a binary file object in fixed-size chunks (for streamed uploads)."""
+    while chunk := fileobj.read(chunk_size):
+        yield chunk
 
 
 # ---- helpers ---------------------------------------------------------------
 
 
+def _get_http_client() -> httpx.Client:
+    """
+    Return the process-wide HTTP client, creating it on first use.
+    Reusing one client keeps TCP/TLS connections alive across requests.
+    """
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.Client(timeout=_TIMEOUT, limits=_POOL_LIMITS, http2=_HTTP2)
+    return _http_client
+
+
+def _get_async_http_client() -> httpx.AsyncClient:
+    """
+    Return the process-wide async HTTP client, creating it on first use.
+    """
+    global _async_http_client
+    if _async_http_client is None or _async_http_client.is_closed:
+        _async_http_client = httpx.AsyncClient(timeout=_TIMEOUT, limits=_POOL_LIMITS, http2=_HTTP2)
+    return _async_http_client
+
+
+def close_http_client():
+    """Close the shared HTTP client (called on application shutdown)."""
+    global _http_client
+    if _http_client is not None:
+        _http_client.close()
+        _http_client = None
+
+
+async def aclose_http_client():
+    """Close the shared async HTTP client (called on application shutdown)."""
+    global _async_http_client
+    if _async_http_client is not None:
+        await _async_http_client.aclose()
+        _async_http_client = None
+
+
 class _Response:
     """
     Mimics the `APIResponse` returned by the official Supabase SDK.
@@ -98,26 +152,32 @@ class _QueryBuilder:
 
     def select(self, columns: str = "*"):
         """
-        Specify columns to select from the table.
+        Specify columns to select from the table. After insert/upsert/update
+        this limits the columns returned for the written rows instead.
         Args:
             columns (str): Comma-separated column names (default: '*').
         Returns:
             self: For chaining.
         """
-        self._method = "GET"
+        if self._body is None:
+            self._method = "GET"
         self._params.append(("select", _clean_select(columns)))
         return self
 
-    def insert(self, data: dict):
+    def insert(self, data: dict | list, *, returning: str = "representation"):
+        """
+        Insert one row or a list of rows. Pass returning="minimal" when the
+        written rows are not needed, so PostgREST does not echo them back.
+        """
         self._method = "POST"
         self._body = data
-        self._prefer.append("return=representation")
+        self._prefer.append(f"return={returning}")
         return self
 
-    def upsert(self, data):
+    def upsert(self, data, *, returning: str = "representation"):
         self._method = "POST"
         self._body = data
-        self._prefer.append("return=representation")
+        self._prefer.append(f"return={returning}")
         self._prefer.append("resolution=merge-duplicates")
         return self
 
@@ -127,9 +187,9 @@ class _QueryBuilder:
         self._prefer.append("return=representation")
         return self
 
-    def delete(self):
+    def delete(self, *, returning: str = "representation"):
         self._method = "DELETE"
-        self._prefer.append("return=representation")
+        self._prefer.append(f"return={returning}")
         return self
 
     # --- filters ---
@@ -235,32 +295,34 @@ class _QueryBuilder:
         )
         return f"{self._base}?{qs}"
 
-    def execute(self) -> _Response:
+    def _request_args(self) -> dict:
+        """Build the keyword arguments for ``httpx.Client.request``."""
+        if self._method not in ("GET", "POST", "PATCH", "DELETE"):
+            raise ValueError(f"Unsupported method: {self._method}")
         headers = {**self._headers, "Content-Type": "application/json",
                    "Accept": "application/json"}
         if self._prefer:
             headers["Prefer"] = ", ".join(self._prefer)
+        args = {"method": self._method, "url": self._build_url(), "headers": headers}
+        if self._method in ("POST", "PATCH"):
+            args["content"] = orjson.dumps(self._body)
+        return args
 
-        url = self._build_url()
+    def execute(self) -> _Response:
+        return self._parse(_get_http_client().request(**self._request_args()))
 
-        with httpx.Client(timeout=_TIMEOUT) as client:
-            if self._method == "GET":
-                r = client.get(url, headers=headers)
-            elif self._method == "POST":
-                r = client.post(url, headers=headers, json=self._body)
-            elif self._method == "PATCH":
-                r = client.patch(url, headers=headers, json=self._body)
-            elif self._method == "DELETE":
-                r = client.delete(url, headers=headers)
-            else:
-                raise ValueError(f"Unsupported method: {self._method}")
+    async def aexecute(self) -> _Response:
+        """Like execute(), but awaits the request instead of blocking a thread."""
+        return self._parse(await _get_async_http_client().request(**self._request_args()))
 
+    @staticmethod
+    def _parse(r: httpx.Response) -> _Response:
         if r.status_code >= 400:
             raise RuntimeError(f"PostgREST error {r.status_code}: {r.text}")
 
         try:
-            data = r.json()
-        except Exception:
+            data = orjson.loads(r.content)
+        except orjson.JSONDecodeError:
             data = []
 
         return _Response(data if isinstance(data, list) else [data] if data else [])
@@ -277,7 +339,7 @@ class _BucketClient:
         self._bucket = bucket
 
     def download(self, path: str) -> bytes:
-        r = httpx.get(
+        r = _get_http_client().get(
             f"{self._url}/object/{self._bucket}/{path}",
             headers=self._headers,
             timeout=_TIMEOUT,
@@ -286,10 +348,30 @@ class _BucketClient:
             raise RuntimeError(f"Storage download error {r.status_code}: {r.text}")
         return r.content
 
-    def upload(self, path: str, file: bytes = None, data: bytes = None,
+    def download_to(self, path: str, fileobj) -> int:
+        """Stream an object into a writable binary file object without
+        buffering the whole body in memory.  Returns the number of bytes written."""
+        written = 0
+        with _get_http_client().stream(
+            "GET",
+            f"{self._url}/object/{self._bucket}/{path}",
+            headers=self._headers,
+            timeout=_TIMEOUT,
+        ) as r:
+            if r.status_code >= 400:
+                r.read()
+                raise RuntimeError(f"Storage download error {r.status_code}: {r.text}")
+            for chunk in r.iter_bytes(_UPLOAD_CHUNK_BYTES):
+                fileobj.write(chunk)
+                written += len(chunk)
+        return written
+
+    def upload(self, path: str, file=None, data: bytes = None,
                file_options: dict | None = None):
         """Upload bytes to storage.  Accepts *file* or *data* as the payload
-        (the official SDK uses ``file``; our earlier version used ``data``)."""
+        (the official SDK uses ``file``; our earlier version used ``data``).
+        *file* may also be a seekable binary file object, which is streamed
+        in chunks instead of being read into memory."""
         payload = file if file is not None else data
         if payload is None:
             raise ValueError("upload() requires file or data bytes")
@@ -298,7 +380,13 @@ class _BucketClient:
         if file_options and "content-type" in file_options:
             content_type = file_options["content-type"]
         headers["Content-Type"] = content_type
-        r = httpx.post(
+        if hasattr(payload, "read"):
+            start = payload.tell()
+            payload.seek(0, 2)
+            headers["Content-Length"] = str(payload.tell() - start)
+            payload.seek(start)
+            payload = _iter_file(payload)
+        r = _get_http_client().post(
             f"{self._url}/object/{self._bucket}/{path}",
             headers=headers,
             content=payload,
@@ -309,7 +397,9 @@ class _BucketClient:
         return r.json()
 
     def remove(self, paths: list[str]):
-        r = httpx.delete(
+        # DELETE with a JSON body needs Client.request(); httpx.delete() takes no body
+        r = _get_http_client().request(
+            "DELETE",
             f"{self._url}/object/{self._bucket}",
             headers={**self._headers, "Content-Type": "application/json"},
             json={"prefixes": paths},
@@ -331,7 +421,7 @@ class _StorageClient:
         return _BucketClient(self._url, self._headers, bucket)
 
     def get_bucket(self, bucket_id: str):
-        r = httpx.get(
+        r = _get_http_client().get(
             f"{self._url}/storage/v1/bucket/{bucket_id}",
             headers=self._headers,
             timeout=_TIMEOUT,
@@ -344,7 +434,7 @@ class _StorageClient:
         body: dict = {"id": bucket_id, "name": bucket_id}
         if options:
             body["public"] = options.get("public", False)
-        r = httpx.post(
+        r = _get_http_client().post(
             f"{self._url}/storage/v1/bucket",
             headers={**self._headers, "Content-Type": "application/json"},
             json=body,
@@ -359,7 +449,7 @@ class _StorageClient:
 
 class SupabaseLiteClient:
     """Drop-in replacement for `supabase.create_client(url, key)`.
-    Supports `.table(name)` and `.storage`."""
+    Supports `.table(name)`, `.rpc(fn, params)` and `.storage`."""
 
     def __init__(self, url: str, key: str):
         self._url = url.rstrip("/")
@@ -374,6 +464,13 @@ class SupabaseLiteClient:
     def table(self, name: str) -> _QueryBuilder:
         return _QueryBuilder(self._url, self._headers, name)
 
+    def rpc(self, fn: str, params: dict | None = None) -> _QueryBuilder:
+        """Call a Postgres function (``POST /rest/v1/rpc/<fn>``)."""
+        builder = _QueryBuilder(self._url, self._headers, f"rpc/{fn}")
+        builder._method = "POST"
+        builder._body = params or {}
+        return builder
+
 
 def create_client(url: str, key: str) -> SupabaseLiteClient:
     """Factory — mirrors `supabase.create_client`."""
@@ -104,6 +104,10 @@ CREATE TABLE IF NOT EXISTS pdf_chunks (
 
 CREATE INDEX IF NOT EXISTS idx_pc_pdf ON pdf_chunks(pdf_id);
 
+-- Estimated Gemini tokens in content, computed at ingest so answer context can be
+-- packed to a token budget without tokenizing at query time
+ALTER TABLE pdf_chunks ADD COLUMN IF NOT EXISTS token_count INTEGER;
+
 -- 8) RAG Embeddings (vector stored as JSON text)
 CREATE TABLE IF NOT EXISTS rag_embeddings (
     id             SERIAL PRIMARY KEY,
@@ -118,10 +122,183 @@ CREATE TABLE IF NOT EXISTS rag_embeddings (
 CREATE INDEX IF NOT EXISTS idx_re_pdf   ON rag_embeddings(pdf_id);
 CREATE INDEX IF NOT EXISTS idx_re_chunk ON rag_embeddings(pdf_chunk_id);
 
+-- int8-quantized copy for the backend's client-side fallback search:
+-- round(v / scale) with scale = max|v| / 127, about 5x smaller to fetch than embedding_json
+ALTER TABLE rag_embeddings ADD COLUMN IF NOT EXISTS embedding_q8    BYTEA;
+ALTER TABLE rag_embeddings ADD COLUMN IF NOT EXISTS embedding_scale REAL;
+
+-- 9) pgvector similarity search
+-- rag_embeddings.embedding mirrors embedding_json as a half-precision vector
+-- (gemini-embedding-001 returns 3072 dims; HNSW supports halfvec up to 4000).
+-- A trigger keeps it in sync, so the backend only ever writes embedding_json.
+CREATE EXTENSION IF NOT EXISTS vector;
+
+ALTER TABLE rag_embeddings ADD COLUMN IF NOT EXISTS embedding halfvec(3072);
+
+CREATE OR REPLACE FUNCTION rag_embeddings_sync_vector() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    BEGIN
+        NEW.embedding := NEW.embedding_json::halfvec(3072);
+    EXCEPTION WHEN others THEN
+        NEW.embedding := NULL;   -- e.g. multimodal vectors with another dimension
+    END;
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_re_sync_vector ON rag_embeddings;
+CREATE TRIGGER trg_re_sync_vector
+    BEFORE INSERT OR UPDATE OF embedding_json ON rag_embeddings
+    FOR EACH ROW EXECUTE FUNCTION rag_embeddings_sync_vector();
+
+-- Backfill rows indexed before the column existed
+UPDATE rag_embeddings SET embedding_json = embedding_json WHERE embedding IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_re_embedding_hnsw ON rag_embeddings
+    USING hnsw (embedding halfvec_cosine_ops) WITH (m = 16, ef_construction = 64);
+
+-- Top-k chunks by cosine similarity, called as POST /rest/v1/rpc/match_rag_chunks
+-- Content is cut to the 700 characters the API shows (RESULT_CONTENT_CHARS in
+-- routers/rag.py), so full chunks are never shipped; token_count is NULL when cut.
+DROP FUNCTION IF EXISTS match_rag_chunks(halfvec, INTEGER, FLOAT);
+CREATE OR REPLACE FUNCTION match_rag_chunks(
+    query_embedding      halfvec(3072),
+    match_count          INTEGER DEFAULT 5,
+    similarity_threshold FLOAT   DEFAULT 0.65
+)
+RETURNS TABLE (
+    id          INTEGER,
+    content     TEXT,
+    source_file VARCHAR,
+    page_number INTEGER,
+    token_count INTEGER,
+    modality    VARCHAR,
+    similarity  FLOAT
+)
+LANGUAGE sql AS $$
+    SELECT set_config('hnsw.ef_search', '40', true);
+    SELECT m.* FROM (
+        SELECT c.id, left(c.content, 700) AS content, c.source_file, c.page_number,
+               CASE WHEN length(c.content) <= 700 THEN c.token_count END AS token_count,
+               e.modality,
+               1 - (e.embedding <=> query_embedding) AS similarity
+        FROM rag_embeddings e
+        JOIN pdf_chunks c ON c.id = e.pdf_chunk_id
+        WHERE e.embedding IS NOT NULL
+        ORDER BY e.embedding <=> query_embedding
+        LIMIT match_count
+    ) m
+    WHERE m.similarity >= similarity_threshold;
+$$;
+
+-- Compressed candidate index: 1 bit per dimension (384 bytes per vector instead of
+-- 6 KB). Candidates are found by Hamming distance on the binary codes, then
+-- re-ranked by exact cosine similarity on the halfvec column.
+CREATE INDEX IF NOT EXISTS idx_re_embedding_bq_hnsw ON rag_embeddings
+    USING hnsw ((binary_quantize(embedding)::bit(3072)) bit_hamming_ops);
+
+DROP FUNCTION IF EXISTS match_rag_chunks_quantized(halfvec, INTEGER, FLOAT, INTEGER);
+CREATE OR REPLACE FUNCTION match_rag_chunks_quantized(
+    query_embedding      halfvec(3072),
+    match_count          INTEGER DEFAULT 5,
+    similarity_threshold FLOAT   DEFAULT 0.65,
+    oversample           INTEGER DEFAULT 10
+)
+RETURNS TABLE (
+    id          INTEGER,
+    content     TEXT,
+    source_file VARCHAR,
+    page_number INTEGER,
+    token_count INTEGER,
+    modality    VARCHAR,
+    similarity  FLOAT
+)
+LANGUAGE sql AS $$
+    SELECT set_config('hnsw.ef_search', (match_count * oversample)::text, true);
+    SELECT m.* FROM (
+        SELECT c.id, left(c.content, 700) AS content, c.source_file, c.page_number,
+               CASE WHEN length(c.content) <= 700 THEN c.token_count END AS token_count,
+               cand.modality,
+               1 - (cand.embedding <=> query_embedding) AS similarity
+        FROM (
+            SELECT e.pdf_chunk_id, e.modality, e.embedding
+            FROM rag_embeddings e
+            WHERE e.embedding IS NOT NULL
+            ORDER BY binary_quantize(e.embedding)::bit(3072) <~> binary_quantize(query_embedding)
+            LIMIT match_count * oversample
+        ) cand
+        JOIN pdf_chunks c ON c.id = cand.pdf_chunk_id
+        ORDER BY cand.embedding <=> query_embedding
+        LIMIT match_count
+    ) m
+    WHERE m.similarity >= similarity_threshold;
+$$;
+
+-- 10) Embedding cache
+-- Content-addressed: content_hash = sha256(model || '\0' || chunk text), so
+-- re-indexing unchanged text reuses the stored vector instead of calling Gemini.
+CREATE TABLE IF NOT EXISTS embedding_cache (
+    content_hash    CHAR(64) PRIMARY KEY,
+    normalized_hash CHAR(64),
+    model           VARCHAR(100) NOT NULL,
+    embedding_json  TEXT NOT NULL,
+    created_at      TIMESTAMPTZ DEFAULT NOW()
+);
+
+-- Second lookup tier: same text modulo case, punctuation and whitespace
+CREATE INDEX IF NOT EXISTS idx_ec_normalized ON embedding_cache(normalized_hash);
+
+-- 11) Answer cache
+-- Generated answers keyed by the query embedding; a new question within cosine
+-- similarity threshold of a fresh entry reuses its answer and results.
+CREATE TABLE IF NOT EXISTS answer_cache (
+    id           SERIAL PRIMARY KEY,
+    embedding    halfvec(3072) NOT NULL,
+    answer       TEXT NOT NULL,
+    results_json TEXT NOT NULL,
+    sources      JSONB NOT NULL DEFAULT '[]',   -- cited source_file names, for invalidation
+    hits         INTEGER DEFAULT 0,
+    created_at   TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_ac_embedding_hnsw ON answer_cache
+    USING hnsw (embedding halfvec_cosine_ops) WITH (m = 16, ef_construction = 64);
+CREATE INDEX IF NOT EXISTS idx_ac_sources ON answer_cache USING gin (sources);
+
+-- Closest fresh cached answer above the threshold (bumping its hit count),
+-- called as POST /rest/v1/rpc/match_answer_cache
+CREATE OR REPLACE FUNCTION match_answer_cache(
+    query_embedding      halfvec(3072),
+    similarity_threshold FLOAT   DEFAULT 0.92,
+    max_age_seconds      INTEGER DEFAULT 3600
+)
+RETURNS TABLE (
+    answer       TEXT,
+    results_json TEXT,
+    similarity   FLOAT
+)
+LANGUAGE sql AS $$
+    WITH best AS (
+        SELECT a.id, 1 - (a.embedding <=> query_embedding) AS similarity
+        FROM answer_cache a
+        WHERE a.created_at > NOW() - make_interval(secs => max_age_seconds)
+        ORDER BY a.embedding <=> query_embedding
+        LIMIT 1
+    )
+    UPDATE answer_cache a SET hits = a.hits + 1
+    FROM best
+    WHERE a.id = best.id AND best.similarity >= similarity_threshold
+    RETURNING a.answer, a.results_json, best.similarity;
+$$;
+
+-- Expired entries are never matched; purge them periodically with:
+-- DELETE FROM answer_cache WHERE created_at < NOW() - INTERVAL '1 hour';
+
 -- =============================================
 -- Row Level Security — service role key bypasses
 -- RLS, so these policies allow full access for
--- the backend. All 8 tables covered.
+-- the backend. All 10 tables covered.
 -- =============================================
 ALTER TABLE users             ENABLE ROW LEVEL SECURITY;
 ALTER TABLE search_history    ENABLE ROW LEVEL SECURITY;
@@ -131,6 +308,8 @@ ALTER TABLE analytics_events  ENABLE ROW LEVEL SECURITY;
 ALTER TABLE pdfs              ENABLE ROW LEVEL SECURITY;
 ALTER TABLE pdf_chunks        ENABLE ROW LEVEL SECURITY;
 ALTER TABLE rag_embeddings    ENABLE ROW LEVEL SECURITY;
+ALTER TABLE embedding_cache   ENABLE ROW LEVEL SECURITY;
+ALTER TABLE answer_cache      ENABLE ROW LEVEL SECURITY;
 
 -- Allow service role full access (backend uses service role key)
 CREATE POLICY "Service role full access" ON users            FOR ALL USING (true) WITH CHECK (true);
@@ -141,6 +320,8 @@ CREATE POLICY "Service role full access" ON analytics_events FOR ALL USING (true
 CREATE POLICY "Service role full access" ON pdfs             FOR ALL USING (true) WITH CHECK (true);
 CREATE POLICY "Service role full access" ON pdf_chunks       FOR ALL USING (true) WITH CHECK (true);
 CREATE POLICY "Service role full access" ON rag_embeddings   FOR ALL USING (true) WITH CHECK (true);
+CREATE POLICY "Service role full access" ON embedding_cache  FOR ALL USING (true) WITH CHECK (true);
+CREATE POLICY "Service role full access" ON answer_cache     FOR ALL USING (true) WITH CHECK (true);
 
 -- =============================================
 -- Storage bucket for PDF files
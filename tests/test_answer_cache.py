@@ -0,0 +1,27 @@
+import pytest
+import answer_cache
+
+RESULTS = [{"id": 1, "content": "Photosynthesis ...", "source": "biology.pdf", "page_number": 3}]
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    answer_cache._l1.clear()
+    yield
+    answer_cache._l1.clear()
+
+def test_get_recent_matches_normalized_query():
+    answer_cache.store(None, "What is photosynthesis?", [0.1], "An answer", RESULTS)
+    assert answer_cache.get_recent("  what is PHOTOSYNTHESIS ") == ("An answer", RESULTS)
+    assert answer_cache.get_recent("what is osmosis") is None
+
+def test_get_recent_expires(monkeypatch):
+    monkeypatch.setattr(answer_cache, "ANSWER_CACHE_L1_TTL_SECONDS", -1)
+    answer_cache.store(None, "What is photosynthesis?", [0.1], "An answer", RESULTS)
+    assert answer_cache.get_recent("What is photosynthesis?") is None
+
+def test_invalidate_drops_answers_citing_file():
+    answer_cache.store(None, "What is photosynthesis?", [0.1], "An answer", RESULTS)
+    answer_cache.store(None, "What is gravity?", [0.2], "Another", [{**RESULTS[0], "source": "physics.pdf"}])
+    answer_cache.invalidate(None, "biology.pdf")
+    assert answer_cache.get_recent("What is photosynthesis?") is None
+    assert answer_cache.get_recent("What is gravity?") is not None
@@ -0,0 +1,16 @@
+import pytest
+from backend.guard import validate_filename, validate_query
+
+def test_validate_filename():
+    assert validate_filename("Unit 3 (notes).pdf") == "Unit 3 (notes).pdf"
+    for bad in ["../secret.pdf", "notes.pdf.exe", "a?b.pdf", ""]:
+        with pytest.raises(ValueError):
+            validate_filename(bad)
+
+def test_validate_query():
+    assert validate_query("  What is AI?  ") == "What is AI?"
+    with pytest.raises(ValueError):
+        validate_query("   ")
+    with pytest.raises(ValueError):
+        validate_query("x" * 1001)
+    assert validate_query("What\x00 is\x1b AI?\n") == "What is AI?"
@@ -0,0 +1,41 @@
+import pytest
+from fastapi.testclient import TestClient
+import backend.main as main
+from backend.main import app
+
+client = TestClient(app)
+
+def test_health_check():
+    response = client.get("/api/health")
+    assert response.status_code == 200
+    data = response.json()
+    assert data["status"] in ["healthy", "degraded"]
+    assert "supabase" in data and "embeddings" in data
+
+def test_health_check_is_cached(monkeypatch):
+    calls = []
+
+    def embeddings_probe():
+        calls.append(1)
+        return True
+
+    monkeypatch.setattr(main, "_health_cache", {})
+    monkeypatch.setattr(main, "check_embeddings", main._cached(60)(embeddings_probe))
+    first = client.get("/api/health").json()
+    second = client.get("/api/health").json()
+    assert first == second
+    assert len(calls) == 1
+
+def test_liveness_check():
+    response = client.get("/api/healthz")
+    assert response.status_code == 200
+    assert response.json()["status"] == "ok"
+
+def test_readiness_check_degraded(monkeypatch):
+    async def failing_check():
+        return False
+
+    monkeypatch.setattr(main, "check_supabase", failing_check)
+    response = client.get("/api/readyz")
+    assert response.status_code == 503
+    assert response.json()["status"] == "degraded"
@@ -16,3 +16,100 @@ def test_rag_search():
     # ...existing code...
 
 # PDF upload test would require authentication and a sample PDF file
+
+def test_search_top_k_is_clamped():
+    from backend.main import rag
+    assert rag._search_top_k(None) == rag.SEARCH_TOP_K
+    assert rag._search_top_k(-3) == 0
+    assert rag._search_top_k(10_000) == rag.SEARCH_MAX_TOP_K
+
+def test_search_with_zero_top_k_returns_early(monkeypatch):
+    from backend.main import auth, rag
+    monkeypatch.setattr(rag, "get_supabase", lambda: pytest.fail("no Supabase call expected"))
+    monkeypatch.setitem(app.dependency_overrides, auth.get_current_user, lambda: {"id": 1, "role": "student"})
+    response = client.post("/api/rag/search", json={"query": "What is AI?", "top_k": 0})
+    assert response.status_code == 200
+    assert response.json()["results"] == []
+    assert response.json()["total_results"] == 0
+
+def test_bulk_qa_requires_staff_role(monkeypatch):
+    from backend.main import auth
+    monkeypatch.setitem(app.dependency_overrides, auth.get_current_user, lambda: {"id": 1, "role": "student"})
+    response = client.post("/api/rag/bulk-qa", json={"queries": ["What is AI?"]})
+    assert response.status_code == 403
+
+SENTENCES = ". ".join(" ".join(f"word{i}" for i in range(n, n + 9)) for n in range(0, 400, 9)) + "."
+PHOTOSYNTHESIS = (
+    "Photosynthesis is the process by which green plants use sunlight, water and carbon dioxide "
+    "to make glucose and release oxygen. It takes place in the chloroplasts, mainly in the leaves, "
+    "where chlorophyll absorbs light energy and drives the light-dependent reactions and the Calvin "
+    "cycle. The glucose is used for respiration and growth or stored as starch, and the oxygen "
+    "diffuses out of the leaf through the stomata into the surrounding air."
+)
+
+@pytest.mark.parametrize("strategy", ["fixed", "paragraph", "sentence"])
+def test_chunks_respect_max_length(strategy):
+    from backend.main import rag
+    for text in (SENTENCES, "x" * 1000):
+        chunks = rag._chunk_text(text, 200, 40, strategy)
+        assert chunks
+        assert max(map(len, chunks)) <= 200
+
+@pytest.mark.parametrize("strategy", ["fixed", "paragraph"])
+def test_window_chunks_overlap_at_word_boundaries(strategy):
+    from backend.main import rag
+    chunks = rag._chunk_text(SENTENCES, 200, 40, strategy)
+    for previous, chunk in zip(chunks, chunks[1:]):
+        first_word = chunk.split()[0]
+        assert first_word in previous.split()
+        assert len(previous) - previous.rindex(first_word) <= 40
+
+def test_sentence_chunks_do_not_overlap():
+    from backend.main import rag
+    chunks = rag._chunk_text(SENTENCES, 200, 40, "sentence")
+    assert " ".join(chunks) == SENTENCES
+    assert all(chunk.endswith(".") for chunk in chunks)
+
+@pytest.mark.parametrize("strategy", ["fixed", "paragraph", "sentence"])
+def test_blank_text_has_no_chunks(strategy):
+    from backend.main import rag
+    assert rag._chunk_text("", 200, 40, strategy) == []
+    assert rag._chunk_text(" \n\n \t ", 200, 40, strategy) == []
+
+@pytest.mark.parametrize("strategy", ["fixed", "paragraph", "sentence"])
+def test_text_without_spaces_or_sentence_ends_is_cut_at_chunk_size(strategy):
+    from backend.main import rag
+    chunks = rag._chunk_text("x" * 1000, 200, 40, strategy)
+    assert all(len(chunk) == 200 for chunk in chunks)
+    assert sum(map(len, chunks)) >= 1000
+
+def test_answer_prompt_drops_near_duplicate_chunks():
+    from backend.main import rag
+    near_duplicate = PHOTOSYNTHESIS.replace("surrounding air.", "surrounding atmosphere.")
+    assert (rag._simhash(PHOTOSYNTHESIS) ^ rag._simhash(near_duplicate)).bit_count() <= rag.SIMHASH_MAX_DISTANCE
+    prompt = rag._build_answer_prompt("What is photosynthesis?", [
+        {"content": PHOTOSYNTHESIS, "source": "biology.pdf", "page_number": 1},
+        {"content": near_duplicate, "source": "biology-v2.pdf", "page_number": 1},
+        {"content": "Gravity pulls masses toward each other.", "source": "physics.pdf", "page_number": 2},
+    ])
+    assert "biology.pdf" in prompt
+    assert "biology-v2.pdf" not in prompt
+    assert "physics.pdf" in prompt
+
+def test_answer_prompt_trims_first_chunk_to_budget(monkeypatch):
+    from backend.main import rag
+    monkeypatch.setattr(rag, "MAX_CONTEXT_TOKENS", 10)
+    prompt = rag._build_answer_prompt("What is photosynthesis?", [
+        {"content": PHOTOSYNTHESIS, "source": "biology.pdf", "page_number": 1},
+        {"content": "Gravity pulls masses toward each other.", "source": "physics.pdf", "page_number": 2},
+    ])
+    context = prompt.split("\n", 2)[2].split("\n\nStudent's Question:")[0]
+    assert len(context) <= 10 * rag.CHARS_PER_TOKEN
+    assert PHOTOSYNTHESIS.startswith(context + " ")
+    assert "physics.pdf" not in prompt
+
+def test_quantize_int8_all_zero_vector():
+    from backend.main import rag
+    quantized, scale = rag._quantize_int8([0.0] * 8)
+    assert list(quantized) == [0] * 8
+    assert scale == 1.0